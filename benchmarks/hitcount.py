@@ -0,0 +1,92 @@
+"""
+Checks the Google hit counter (orderanki.hits) against saved results pages, served by a local stand-in.
+
+    python benchmarks/hitcount.py
+
+benchmarks/fixtures holds trimmed results pages ("About N results", an exact count, "1 result", a second page, an
+empty result-stats element, a page that matched nothing, and a consent page) and the hit count each must give, or
+none.  Each page is fetched through HttpHitCounter, searching for the page's file name, and must count as expected;
+searching again must be answered from the cache.  Fails on any wrong count.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+import threading
+from urllib import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from orderanki import hits, net
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class ResultsPageHandler(BaseHTTPRequestHandler):
+    """
+    Answers /search?q=<page> with the saved results page of that name from benchmarks/fixtures.
+    """
+
+    requests = 0
+
+    def do_GET(self) -> None:
+        ResultsPageHandler.requests += 1
+        parts = parse.urlsplit(self.path)
+        page = dict(parse.parse_qsl(parts.query)).get("q", "")
+        path = os.path.join(FIXTURES, os.path.basename(page))
+        if parts.path != "/search" or not page.startswith("hits_") or not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def read_expected(path: str):
+    """
+    Returns the (page, expected hits or None) pairs of an expectations file.
+    """
+
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            page, count = line.rstrip("\n").split("\t")
+            pairs.append((page, int(count) if count else None))
+    return pairs
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ResultsPageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    expected = read_expected(os.path.join(FIXTURES, "hits_expected.tsv"))
+    pages = [page for page, _ in expected]
+    failures = []
+    base = "http://127.0.0.1:{}".format(server.server_address[1])
+    with hits.HttpHitCounter(base, limiter=net.RateLimiter(1000, 1)) as counter:
+        counts = counter.count_many(pages)
+        for (page, want), got in zip(expected, counts):
+            print("{}: {}".format(page, got))
+            if got != want:
+                failures.append("{} counted {}, not {}".format(page, got, want))
+        # Pages with a count are cached; the others are searched again
+        sent = ResultsPageHandler.requests
+        counter.count_many(pages)
+        again = ResultsPageHandler.requests - sent
+        uncounted = sum(1 for _, want in expected if want is None)
+        if again != uncounted:
+            failures.append("searching again sent {} requests, not {}".format(again, uncounted))
+    server.shutdown()
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,65 @@
+"""
+Measures what importing the orderanki add-on costs on Anki launch, using "python -X importtime".
+
+    python benchmarks/importtime.py [--budget-ms 5]
+
+Anki has already imported aqt by the time add-ons load, so aqt is imported first (when available) and is not counted.
+Fails if the add-on takes longer than the budget, or pulls in modules that should only load on first use.
+"""
+
+from argparse import ArgumentParser
+import os
+import re
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+LAZY_MODULES = ["requests", "orderanki.wiki", "orderanki.dialog", "orderanki.ordering", "orderanki.refresh", "orderanki.scoring", "aqt.fields", "queue"]
+"""
+Modules that the add-on must not import at launch (Anki itself may, which is fine if aqt is available)
+"""
+
+_line_re = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(runs: int = 5):
+    """
+    Imports orderanki in fresh interpreters and returns (best cumulative microseconds, modules imported by orderanki).
+    """
+
+    code = "try:\n import aqt\nexcept ImportError:\n pass\nimport orderanki"
+    env = dict(os.environ, PYTHONPATH=SRC + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    best = None
+    imported = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env,
+                             capture_output=True, text=True, check=True).stderr
+        lines = [m for m in map(_line_re.match, out.splitlines()) if m]
+        # Children are listed before their parent, so everything between the last aqt line and orderanki is ours
+        start = max((i + 1 for i, m in enumerate(lines) if m.group(4) == "aqt" and len(m.group(3)) == 1), default=0)
+        end = next(i for i, m in enumerate(lines) if m.group(4) == "orderanki")
+        cumulative = int(lines[end].group(2))
+        if best is None or cumulative < best:
+            best = cumulative
+            imported = [m.group(4) for m in lines[start:end + 1]]
+    return best, imported
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the import time of the orderanki add-on.")
+    parser.add_argument("--budget-ms", type=float, default=5.0, help="fail if importing takes longer than this")
+    parser.add_argument("--runs", type=int, default=5, help="how many fresh interpreters to take the best of")
+    args = parser.parse_args()
+
+    us, imported = measure(args.runs)
+    print("orderanki import: {:.2f} ms, {} modules: {}".format(us / 1000, len(imported), ", ".join(imported)))
+    failed = False
+    eager = [m for m in imported if m in LAZY_MODULES]
+    if eager:
+        print("FAIL: imported at launch instead of on first use: " + ", ".join(eager))
+        failed = True
+    if us / 1000 > args.budget_ms:
+        print("FAIL: over the {:.2f} ms budget".format(args.budget_ms))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,381 @@
+"""
+Measures the memory of Add Fame's fetch-and-write pipeline on large selections, with no Anki and no network.
+
+    python benchmarks/memory.py [--notes 10000,100000,500000] [--tolerance 0.25] [--write-baseline]
+
+Each size runs in a fresh process against a fake collection (a SQLite file shaped like Anki's notes table) and a local
+HTTP stand-in for Wikipedia, pageviews and Wikidata, which the real request path is routed to.  The stages are the
+ones the dialog runs: sitelinks for every note, then pageviews and descriptions, then ranking.  For each stage it
+reports the peak RSS above the stage's start, the peak traced (tracemalloc) memory, and the lines that allocated the
+memory still held when the stage ends.
+
+Fails if any stage's memory per note is more than tolerance (and a few MiB) above benchmarks/memory_baseline.json;
+sizes with no baseline are only checked against the others.  The engine streams, so its stages (sitelinks and
+pageviews) must also not use more traced memory in all on a larger selection than on the smallest one run, and their
+RSS per note has to fall as the selection grows.  Ranking holds a column per note, so it is only held to the
+baseline.  Peak RSS is only measured per stage on Linux; elsewhere it is the process's peak so far.
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gc
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib import parse
+import zlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_baseline.json")
+FIELD = "Wiki Pageviews"
+FIELDS = ["Name", FIELD, FIELD + " (URL)", FIELD + " (URL fixed)", FIELD + " (Description)", FIELD + " (Sitelinks)"]
+STAGES = ("sitelinks", "pageviews", "rank")
+STREAMING = ("sitelinks", "pageviews")
+"""
+The stages whose peak memory must not depend on the selection size
+"""
+TOP = 5
+SLACK_BYTES = 4 << 20
+"""
+How much more than the baseline (plus tolerance) a whole stage may use before it fails, since RSS is noisy by a few
+pages and small stages are all noise
+"""
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests orderanki.wiki makes, with bodies shaped (and sized) like the real ones.  Requests arrive
+    with the real host as the first part of the path, e.g. /en.wikipedia.org/w/api.php?...
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; with Nagle on, every keep-alive response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        parts = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(parts.query))
+        if "/pageviews/per-article/" in parts.path:
+            body = self.pageviews(parts.path)
+        elif query.get("action") == "opensearch":
+            title = query["search"]
+            body = [title, [title], [""], ["https://en.wikipedia.org/wiki/" + parse.quote(title.replace(" ", "_"))]]
+        elif query.get("action") == "wbgetentities":
+            body = {"entities": {qid: {"type": "item", "id": qid, "sitelinks": {
+                "site{}wiki".format(k): {"site": "site{}wiki".format(k), "title": qid, "badges": []}
+                for k in range(int(qid[1:]) % 40)}} for qid in query["ids"].split("|")}}
+        elif query.get("action") == "query":
+            pages = {}
+            for i, title in enumerate(query["titles"].split("|")):
+                page = {"pageid": i + 1, "ns": 0, "title": title}
+                if query.get("prop") == "pageprops":
+                    page["pageprops"] = {"wikibase_item": "Q{}".format(zlib.crc32(title.encode("utf-8")))}
+                else:
+                    page["description"] = "Synthetic person number {}".format(title.rsplit(" ", 1)[-1])
+                pages[str(i + 1)] = page
+            body = {"batchcomplete": "", "query": {"pages": pages}}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def pageviews(self, path: str):
+        article = path.split("/")[-4]
+        views = zlib.crc32(article.encode("utf-8")) % 100000
+        # Monthly items from 2015-07 to 2022-12, as the dialog asks for
+        return {"items": [{"project": "en.wikipedia", "article": article, "granularity": "monthly",
+            "timestamp": "{}{:02d}0100".format(2015 + (6 + m) // 12, (6 + m) % 12 + 1), "access": "all-access",
+            "agent": "user", "views": views} for m in range(90)]}
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def serve(ports: multiprocessing.Queue) -> None:
+    """
+    Runs the stand-in on a free port (in its own process, so that it does not count towards the measurements).
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def route_to(base: str) -> None:
+    """
+    Sends all of orderanki.wiki's HTTPS requests to the stand-in at base, through the real requests path.
+    """
+
+    import requests
+    from orderanki import wiki
+
+    class StandInAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, **kwargs):
+            parts = parse.urlsplit(request.url)
+            request.url = "{}/{}{}{}".format(base, parts.netloc, parts.path, "?" + parts.query if parts.query else "")
+            return super().send(request, **kwargs)
+
+    make_session = wiki._session
+
+    def session():
+        s = make_session()
+        if not isinstance(s.get_adapter("https://"), StandInAdapter):
+            s.mount("https://", StandInAdapter())
+        return s
+
+    wiki._session = session
+
+
+class FakeNote(dict):
+    def __init__(self, nid: int, fields) -> None:
+        dict.__init__(self, fields)
+        self.id = nid
+
+
+class FakeCollection:
+    """
+    Just enough of anki.collection.Collection for the engine and scoring, backed by a SQLite notes table like Anki's.
+    """
+
+    class _DB:
+        def __init__(self, conn: sqlite3.Connection) -> None:
+            self.conn = conn
+
+        def execute(self, sql: str, *args):
+            return self.conn.execute(sql, args).fetchall()
+
+        def list(self, sql: str, *args):
+            return [row[0] for row in self.conn.execute(sql, args)]
+
+    class _Models:
+        def get(self, mid: int):
+            return {"id": mid, "flds": [{"name": name} for name in FIELDS]}
+
+        def field_names(self, model):
+            return [f["name"] for f in model["flds"]]
+
+    def __init__(self, path: str, n: int) -> None:
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("create table notes (id integer primary key, mid integer, flds text)")
+        self.conn.executemany("insert into notes values (?, 1, ?)",
+            (((i, "Person {}".format(i) + "\x1f" * (len(FIELDS) - 1)) for i in range(1, n + 1))))
+        self.conn.commit()
+        self.db = self._DB(self.conn)
+        self.models = self._Models()
+        self.crt = 0
+
+    def get_note(self, nid: int) -> FakeNote:
+        flds = self.conn.execute("select flds from notes where id = ?", (nid,)).fetchone()[0]
+        return FakeNote(nid, zip(FIELDS, flds.split("\x1f")))
+
+    def update_notes(self, notes) -> None:
+        self.conn.executemany("update notes set flds = ? where id = ?",
+            (("\x1f".join(note[name] for name in FIELDS), note.id) for note in notes))
+
+    def update_note(self, note: FakeNote) -> None:
+        self.update_notes([note])
+
+
+class FakeMainWindow:
+    def __init__(self, col: FakeCollection) -> None:
+        self.col = col
+
+
+def rss() -> int:
+    """
+    Returns (current RSS, peak RSS since the last reset_peak_rss) in bytes.  Without /proc, both are the process's
+    peak so far.
+    """
+
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else 0
+        peak *= 1 if sys.platform == "darwin" else 1024
+        return peak, peak
+
+
+def reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def measure(n: int, base: str):
+    """
+    Runs the pipeline on n synthetic notes, in this process.  Returns {stage: measurements}.
+    """
+
+    from orderanki import engine, scoring
+
+    route_to(base)
+    tracemalloc.start()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        col = FakeCollection(os.path.join(tmp, "collection.anki2"), n)
+        mw = FakeMainWindow(col)
+        nids = list(range(1, n + 1))
+
+        def run_engine(metrics, reuse_articles=False):
+            fame_engine = engine.FameEngine(mw, nids, lambda fields: fields["Name"], FIELD, rate=100000,
+                metrics=metrics, reuse_articles=reuse_articles)
+            stats = fame_engine.run()
+            assert stats.populated == n, "only {} of {} notes were populated".format(stats.populated, n)
+
+        def rank():
+            columns = scoring.read_columns(col, nids, [FIELD])
+            assert len(scoring.rank(columns, {FIELD: 1})) == n
+
+        stages = {
+            "sitelinks": lambda: run_engine(("sitelinks",)),
+            # As in the dialog, the articles found by the sitelinks run are not searched again
+            "pageviews": lambda: run_engine(("pageviews", "desc"), reuse_articles=True),
+            "rank": rank,
+        }
+        for stage in STAGES:
+            gc.collect()
+            tracemalloc.clear_traces()
+            tracemalloc.reset_peak()
+            start_rss, _ = rss()
+            reset_peak_rss()
+            start = time.perf_counter()
+            stages[stage]()
+            elapsed = time.perf_counter() - start
+            _, peak_rss = rss()
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            top = ["{}:{} {:.1f} KiB in {} blocks".format(stat.traceback[0].filename, stat.traceback[0].lineno,
+                stat.size / 1024, stat.count) for stat in snapshot.statistics("lineno")[:TOP]]
+            del snapshot
+            results[stage] = {
+                "seconds": elapsed,
+                "rss_per_note": max(peak_rss - start_rss, 0) / n,
+                "traced_per_note": traced_peak / n,
+                "top": top,
+            }
+        col.conn.close()
+    tracemalloc.stop()
+    return results
+
+
+def over_baseline(n: int, results, baseline, tolerance: float):
+    """
+    Returns a description of each measurement of a run that is more than tolerance above the baseline.
+    """
+
+    failures = []
+    for stage, measured in results.items():
+        for key in ("rss_per_note", "traced_per_note"):
+            expected = baseline.get(str(n), {}).get(stage, {}).get(key)
+            if expected is None:
+                continue
+            limit = expected * (1 + tolerance) + SLACK_BYTES / n
+            if measured[key] > limit:
+                failures.append("{} notes, {}: {} is {:.0f} bytes, over {:.0f} (baseline {:.0f} + {:.0%})".format(
+                    n, stage, key, measured[key], limit, expected, tolerance))
+    return failures
+
+
+def grows_with_n(measured, tolerance: float):
+    """
+    Returns a description of each streaming stage whose memory grows with the selection: its peak traced memory on a
+    larger selection is more than tolerance (and a few MiB) above its peak on the smallest selection of the run, or its
+    RSS per note does not fall.  RSS also counts the allocator's fragmentation, which creeps up over a long run but
+    levels off, so only traced memory is held to a fixed ceiling.
+
+    :param measured: {notes: {stage: measurements}}
+    """
+
+    failures = []
+    sizes = sorted(measured)
+    for smaller, n in zip(sizes, sizes[1:]):
+        for stage in STREAMING:
+            ceiling = measured[sizes[0]][stage]["traced_per_note"] * sizes[0] * (1 + tolerance) + SLACK_BYTES
+            peak = measured[n][stage]["traced_per_note"] * n
+            if peak > ceiling:
+                failures.append("{} notes, {}: traced memory peaks at {:.1f} MiB, over {:.1f} MiB ({} notes + {:.0%}), "
+                    "so it grows with the selection".format(n, stage, peak / 2**20, ceiling / 2**20, sizes[0],
+                    tolerance))
+            if measured[n][stage]["rss_per_note"] >= measured[smaller][stage]["rss_per_note"]:
+                failures.append("{} notes, {}: {:.0f} bytes RSS per note, not less than {:.0f} at {} notes, so it "
+                    "grows with the selection".format(n, stage, measured[n][stage]["rss_per_note"],
+                    measured[smaller][stage]["rss_per_note"], smaller))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the memory of the fetch-and-write pipeline.")
+    parser.add_argument("--notes", default="10000,100000,500000", help="comma-separated selection sizes to run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="fail if memory per note is this much over the baseline")
+    parser.add_argument("--write-baseline", action="store_true", help="store this run's results as the baseline")
+    parser.add_argument("--run", type=int, metavar="NOTES", help="(internal) run one size in this process")
+    parser.add_argument("--base", help="(internal) the stand-in's URL")
+    args = parser.parse_args()
+
+    if args.run is not None:
+        print(json.dumps(measure(args.run, args.base)))
+        sys.exit(0)
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(ports,), daemon=True)
+    server.start()
+    base = "http://127.0.0.1:{}".format(ports.get())
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+    runs = {}
+    measured = {}
+    failures = []
+    for n in [int(size) for size in args.notes.split(",")]:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", str(n), "--base", base],
+            check=True, stdout=subprocess.PIPE).stdout
+        results = runs[n] = json.loads(out)
+        for stage in STAGES:
+            r = results[stage]
+            print("{} notes, {}: {:.1f}s, {:.0f} bytes RSS and {:.0f} bytes traced per note".format(
+                n, stage, r["seconds"], r["rss_per_note"], r["traced_per_note"]))
+            for line in r["top"]:
+                print("    " + line)
+        measured[str(n)] = {stage: {key: round(results[stage][key]) for key in ("rss_per_note", "traced_per_note")}
+            for stage in STAGES}
+        failures += over_baseline(n, results, baseline, args.tolerance)
+    server.terminate()
+    failures += grows_with_n(runs, args.tolerance)
+
+    if args.write_baseline and not failures:
+        baseline.update(measured)
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Wrote", BASELINE)
+    elif failures:
+        for failure in failures:
+            print("FAIL: " + failure)
+        sys.exit(1)
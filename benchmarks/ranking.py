@@ -0,0 +1,78 @@
+"""
+Measures how long orderanki.scoring takes to rank a large selection of notes by fame.
+
+    python benchmarks/ranking.py [--notes 1000000] [--budget-seconds 1]
+
+The columns are heavy-tailed like real pageviews and hit counts, with some missing values.  Fails if ranking takes
+longer than the budget, or if tied values do not rank alike (with numpy and in pure Python).
+"""
+
+from argparse import ArgumentParser
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from orderanki import scoring
+
+
+def make_columns(n: int):
+    rng = random.Random(0)
+    return {
+        "pageviews": [None if rng.random() < 0.05 else int(rng.paretovariate(1.2) * 1000) for _ in range(n)],
+        "googlehits": [None if rng.random() < 0.2 else int(rng.paretovariate(1.1) * 10000) for _ in range(n)],
+        "age": [1600000000000 + i * 1000 for i in range(n)],
+    }
+
+
+def measure(n: int) -> float:
+    """
+    Returns how many seconds it takes to rank n notes from their field values.
+    """
+
+    columns = make_columns(n)
+    start = time.perf_counter()
+    order = scoring.rank(columns, {"pageviews": 2, "googlehits": 1, "age": -0.5}, methods={"age": "percentile"})
+    elapsed = time.perf_counter() - start
+    assert len(order) == n
+    return elapsed
+
+
+def check_ties():
+    """
+    Returns a description of each way tied values are ranked wrongly: equal values must normalize alike, and notes
+    that all score the same must keep their input order.
+    """
+
+    failures = []
+    numpy = scoring.np
+    backends = [("numpy", numpy), ("pure python", None)] if numpy is not None else [("pure python", None)]
+    for backend, scoring.np in backends:
+        got = [round(float(v), 3) for v in scoring.normalize([5, 5, 5, 1], "percentile")]
+        if got != [0.667, 0.667, 0.667, 0.0]:
+            failures.append("{}: percentile of [5, 5, 5, 1] is {}".format(backend, got))
+        for method in ("percentile", "log", "linear"):
+            order = scoring.rank({"x": [7] * 5}, {"x": 1}, methods={"x": method})
+            if list(order) != list(range(5)):
+                failures.append("{}: {} ranks 5 equal notes as {}".format(backend, method, order))
+    scoring.np = numpy
+    return failures
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark ranking notes by fame.")
+    parser.add_argument("--notes", type=int, default=1000000, help="how many notes to rank")
+    parser.add_argument("--budget-seconds", type=float, default=1, help="fail if ranking takes longer than this")
+    args = parser.parse_args()
+
+    failures = check_ties()
+    elapsed = measure(args.notes)
+    backend = "numpy" if scoring.np is not None else "pure python"
+    print("{} notes ranked in {:.3f}s ({})".format(args.notes, elapsed, backend))
+    if elapsed > args.budget_seconds:
+        failures.append("over the {:.2f}s budget".format(args.budget_seconds))
+    if failures:
+        for failure in failures:
+            print("FAIL: " + failure)
+        sys.exit(1)
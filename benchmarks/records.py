@@ -0,0 +1,56 @@
+"""
+Measures the memory and GC cost of per-note fame state (wiki.Wikifame) on a 100k-note run.
+
+    python benchmarks/records.py [--notes 100000] [--budget-bytes 200]
+
+Fails if a Wikifame (not counting its search phrase, which belongs to the note) costs more than the budget.
+"""
+
+from argparse import ArgumentParser
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from orderanki import wiki
+
+
+def measure(n: int):
+    """
+    Makes n Wikifames sharing one FieldNames, as the engine does, and fills them in.
+    Returns (bytes per record, GC generation-0 collections triggered).
+    """
+
+    phrases = ["Search phrase {}".format(i) for i in range(n)]
+    articles = ["Article_{}".format(i) for i in range(n)]
+    records = [None] * n
+    names = wiki.FieldNames.named_after("Wiki Pageviews")
+    gc.collect()
+    collections = gc.get_stats()[0]["collections"]
+    tracemalloc.start()
+    for i in range(n):
+        wf = wiki.Wikifame(None, i, search_phrase=phrases[i], project="en.wikipedia.org", field_names=names)
+        wf.set("article", articles[i])
+        wf.set("article_fixed", articles[i])
+        wf.set("pageviews", i)
+        wf.set("desc", "")
+        records[i] = wf
+    # The strings and the records list were made beforehand, so this is the records and the state they own
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    collections = gc.get_stats()[0]["collections"] - collections
+    return used / n, collections
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the memory cost of per-note fame state.")
+    parser.add_argument("--notes", type=int, default=100000, help="how many records to make")
+    parser.add_argument("--budget-bytes", type=float, default=200, help="fail if a record costs more than this")
+    args = parser.parse_args()
+
+    per_record, collections = measure(args.notes)
+    print("{} records: {:.0f} bytes per record, {} gen-0 collections".format(args.notes, per_record, collections))
+    if per_record > args.budget_bytes:
+        print("FAIL: over the {:.0f} byte budget".format(args.budget_bytes))
+        sys.exit(1)
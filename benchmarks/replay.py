@@ -0,0 +1,37 @@
+"""
+Measures the fetch pipeline's own overhead (coalescing, threading, JSON handling) with the network taken out, by
+replaying a cassette recorded from a real run.
+
+    cd src && python -m orderanki.wiki -d --record ../run.cassette names.txt > /dev/null  # once, with network
+    python benchmarks/replay.py run.cassette names.txt [--pace] [--concurrency 20]
+
+Instant replay gives the CPU cost per input; --pace replays the recorded latencies, for comparing concurrency
+settings reproducibly.
+"""
+
+from argparse import ArgumentParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from orderanki import wiki
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the fetch pipeline by replaying a cassette.")
+    parser.add_argument("cassette", help="a cassette recorded with python -m orderanki.wiki --record")
+    parser.add_argument("input", help="the input file the cassette was recorded with")
+    parser.add_argument("--pace", action="store_true", help="replay the recorded latencies instead of instantly")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="how many requests may be in flight at once")
+    args = parser.parse_args()
+
+    with open(args.input, encoding="utf-8") as f:
+        inputs = sum(1 for line in f if line.strip())
+    argv = [args.input, "-o", os.devnull, "-d", "--replay", args.cassette, "-c", str(args.concurrency)]
+    if args.pace:
+        argv.append("--pace")
+    start = time.perf_counter()
+    wiki.main(argv)
+    elapsed = time.perf_counter() - start
+    print("{} inputs replayed in {:.3f}s: {:.0f} us per input".format(inputs, elapsed, 1e6 * elapsed / max(inputs, 1)))
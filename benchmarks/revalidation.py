@@ -0,0 +1,173 @@
+"""
+Checks that the background refresher revalidates instead of downloading again: two refresh sessions on different days
+must send the second day's requests as conditional ones, answered with 304 Not Modified.
+
+    python benchmarks/revalidation.py [--notes 50]
+
+The refresher runs against a fake collection, its user_files in a temporary folder, and a local HTTP stand-in for the
+pageviews API that sends an ETag and honours If-None-Match.  For "two days later" the clock (time.time and
+datetime.date.today) is moved on two days.  Fails if any second-day request is unconditional (its cache key changed,
+or its validators were lost), or if a session counts its requests wrongly.
+"""
+
+from argparse import ArgumentParser
+import concurrent.futures
+import datetime
+from http.server import ThreadingHTTPServer
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from memory import StandInHandler, route_to
+from orderanki import net, refresh
+
+ETAG = '"pageviews-v1"'
+DAY = 86400
+FIELDS = ["Name", "Wiki Pageviews", "Wiki Pageviews (URL fixed)"]
+
+
+class RevalidatingHandler(StandInHandler):
+    """
+    The memory benchmark's stand-in, with an ETag on every response and 304s for requests that already have it.
+    """
+
+    seen = []
+
+    def do_GET(self) -> None:
+        conditional = self.headers.get("If-None-Match")
+        RevalidatingHandler.seen.append(conditional)
+        if conditional != ETAG:
+            StandInHandler.do_GET(self)
+            return
+        self.send_response(304)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def end_headers(self) -> None:
+        self.send_header("ETag", ETAG)
+        StandInHandler.end_headers(self)
+
+
+class FakeNote(dict):
+    pass
+
+
+class FakeCollection:
+    """
+    Just enough of anki.collection.Collection for the refresher: one note type with Add Fame's fields.
+    """
+
+    class _DB:
+        def __init__(self, conn: sqlite3.Connection) -> None:
+            self.conn = conn
+
+        def execute(self, sql: str, *args):
+            return self.conn.execute(sql, args).fetchall()
+
+    class _Models:
+        def all(self):
+            return [{"id": 1, "flds": [{"name": name} for name in FIELDS]}]
+
+    def __init__(self, n: int) -> None:
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.execute("create table notes (id integer primary key, mid integer, flds text)")
+        self.conn.executemany("insert into notes values (?, 1, ?)",
+            ((i, "Person {}\x1f\x1fPerson_{}".format(i, i)) for i in range(1, n + 1)))
+        self.db = self._DB(self.conn)
+        self.models = self._Models()
+
+    def get_note(self, nid: int) -> FakeNote:
+        flds = self.conn.execute("select flds from notes where id = ?", (nid,)).fetchone()[0]
+        note = FakeNote(zip(FIELDS, flds.split("\x1f")))
+        note.id = nid
+        return note
+
+    def update_notes(self, notes, skip_undo_entry: bool = False) -> None:
+        self.conn.executemany("update notes set flds = ? where id = ?",
+            (("\x1f".join(note[name] for name in FIELDS), note.id) for note in notes))
+
+
+class FakeTaskManager:
+    def run_in_background(self, task, on_done, uses_collection: bool = False) -> None:
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(task())
+        except Exception as err:
+            future.set_exception(err)
+        on_done(future)
+
+
+class FakeMainWindow:
+    def __init__(self, col: FakeCollection) -> None:
+        self.col = col
+        self.taskman = FakeTaskManager()
+
+
+def refresh_session(mw: FakeMainWindow, n: int):
+    """
+    Runs one refresh session.  Returns (its conditional requests, its unconditional ones, the requests it counted).
+    """
+
+    del RevalidatingHandler.seen[:]
+    refresher = refresh.Refresher(mw, {"max_age_days": 1, "session_requests": n, "rate_per_second": 1000})
+    refresher.start()
+    conditional = sum(1 for etag in RevalidatingHandler.seen if etag is not None)
+    return conditional, len(RevalidatingHandler.seen) - conditional, refresher.requests
+
+
+def two_days_later() -> None:
+    """
+    Moves the clock on two days, for the whole process.
+    """
+
+    now = time.time
+    time.time = lambda: now() + 2 * DAY
+
+    class Date(datetime.date):
+        @classmethod
+        def today(cls):
+            return datetime.date.fromtimestamp(time.time())
+
+    datetime.date = Date
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check that background refreshes revalidate cached pageviews.")
+    parser.add_argument("--notes", type=int, default=50, help="how many notes to refresh")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RevalidatingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    route_to("http://127.0.0.1:{}".format(server.server_address[1]))
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        net.USER_FILES = tmp
+        col = FakeCollection(args.notes)
+        mw = FakeMainWindow(col)
+        days = [refresh_session(mw, args.notes)]
+        two_days_later()
+        days.append(refresh_session(mw, args.notes))
+        filled = sum(1 for nid in range(1, args.notes + 1) if col.get_note(nid)["Wiki Pageviews"])
+        col.conn.close()
+    server.shutdown()
+
+    for day, (conditional, unconditional, counted) in enumerate(days, 1):
+        print("Day {}: {} conditional and {} unconditional requests ({} counted)".format(day, conditional,
+            unconditional, counted))
+        if counted != conditional + unconditional:
+            failures.append("day {} counted {} requests, but sent {}".format(day, counted, conditional + unconditional))
+    if days[0][1] != args.notes:
+        failures.append("day 1 fetched {} of {} notes".format(days[0][1], args.notes))
+    if days[1][0] != args.notes or days[1][1]:
+        failures.append("day 2 revalidated {} of {} notes".format(days[1][0], args.notes))
+    if filled != args.notes:
+        failures.append("only {} of {} notes got pageviews".format(filled, args.notes))
+    for failure in failures:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,81 @@
+"""
+Checks the offline title index (orderanki.titleindex) against a small dump, and measures its lookups.
+
+    python benchmarks/titlelookup.py [--extra 200000]
+
+benchmarks/fixtures holds an excerpt of an all-titles dump, a redirect file, and the title each of a list of phrases
+must resolve to (or nothing).  The phrases cover normalisation (case, underscores, whitespace, case-folding), redirects
+and redirect chains, titles that beat redirects sharing their key, and misses.  The index is built from a gzipped
+copy of the dump plus extra synthetic titles, so that its binary search spans many pages; every synthetic title must
+be found, and a near miss of each must not be.  Fails on any wrong lookup.
+"""
+
+from argparse import ArgumentParser
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from orderanki import titleindex
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def read_expected(path: str):
+    """
+    Returns the (phrase, expected title or None) pairs of an expectations file.
+    """
+
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            # Phrases may contain tabs, titles never do
+            phrase, title = line.rstrip("\n").rsplit("\t", 1)
+            pairs.append((phrase, title or None))
+    return pairs
+
+
+def synthetic_titles(n: int):
+    return ["Synthetic_person_{}".format(i) for i in range(n)]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check the offline title index against a fixture dump.")
+    parser.add_argument("--extra", type=int, default=200000, help="how many synthetic titles to add to the dump")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = os.path.join(tmp, "titles.gz")
+        with open(os.path.join(FIXTURES, "titleindex_titles.txt"), "rb") as src, gzip.open(dump, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+            dst.write("".join(title + "\n" for title in synthetic_titles(args.extra)).encode("utf-8"))
+        path = os.path.join(tmp, "titles.idx")
+        keys = titleindex.build_index(titleindex.read_titles(dump),
+            titleindex.read_redirects(os.path.join(FIXTURES, "titleindex_redirects.tsv")), path)
+        index = titleindex.TitleIndex(path)
+
+        for phrase, expected in read_expected(os.path.join(FIXTURES, "titleindex_expected.tsv")):
+            got = index.lookup_title(phrase)
+            if got != expected:
+                failures.append("{!r} resolved to {!r}, not {!r}".format(phrase, got, expected))
+
+        start = time.perf_counter()
+        for title in synthetic_titles(args.extra):
+            if index.lookup_title(title.replace("_", " ")) != title:
+                failures.append("{!r} was not found".format(title))
+            if index.lookup_title(title + " x") is not None:
+                failures.append("{!r} should not be found".format(title + " x"))
+        elapsed = time.perf_counter() - start
+        index.close()
+
+    print("{} keys; {} lookups in {:.3f}s ({:.1f} us each)".format(keys, 2 * args.extra, elapsed,
+        1e6 * elapsed / max(2 * args.extra, 1)))
+    for failure in failures[:20]:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
@@ -32,25 +32,32 @@
 
 # IMPORTS
 from argparse import ArgumentParser
+import concurrent.futures
 import sqlite3
 import zipfile
+import glob
 import json
 import os
 import re
 import copy
 import csv
 import shutil
+import sys
+import time
 from urllib import request, parse
-from selenium import webdriver
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from orderanki import cassette, famepack, hits, net, phrases, scoring
 
 # INPUTS
+package_paths = []
+"""
+the .apkg files to order, including ".apkg".  ".colpkg" not yet supported.
+"""
+
 apkg_path = ""
 """
-absolute path to .apkg file, including ".apkg".  ".colpkg" not yet supported.
+absolute path to the .apkg file being ordered, without ".apkg"
 """
 
 identifiers = ""
@@ -71,11 +78,54 @@ start_date = "20150701"
 end_date = "20220901"
 get_wiki_pv = True
 get_google_hits = False
+google_workers = 4
 max_rows = -1
 verbosity_input = 10
+fame_pack_path = ""
+"""
+optional path to a fame pack of precomputed fame data, used instead of fetching where possible
+"""
+cassette_path = ""
+"""
+optional path to a cassette file to record every Wikipedia/Google response to, or (with replay) to replay them from
+"""
+replay = False
+pace = False
+batch = False
+"""
+order every package without stopping for the spreadsheet review, jobs at a time, sharing cache_path and the rate limit
+"""
+jobs = os.cpu_count() or 1
+cache_path = ""
+"""
+optional path to an SQLite cache of responses, shared by every deck (and process) of a run
+"""
+rate = 100
+"""
+the most Wikipedia requests to send per second, across all processes
+"""
+
+weights = {"pageviews": 1, "googlehits": 1, "age": 0}
+"""
+how much each fame signal counts towards the ordering (see orderanki.scoring).  "age" is the note's creation time
+(its nid); a negative weight puts older notes first.
+"""
 
 # GLOBAL VARS
 ident_fields_of_model = {} # model -> ident field
+tape = None
+"""
+The open cassette.Cassette, if recording or replaying
+"""
+cache = None
+"""
+The open net.Cache of cache_path, if any
+"""
+limiter = None
+"""
+The net.RateLimiter (a net.SharedRateLimiter in batch mode) that Wikipedia requests wait on
+"""
+google_limiter = None
 notes = []
 """
 List of {"nid": note_id, "ident": ident_name, "fame": ...} dicts
@@ -93,12 +143,31 @@ def parse_inputs():
                         help="the starting date for wikipedia view data. format YYYYMMDD")
     parser.add_argument("-e", "--end", dest="end_date", default="20220901",
                         help="the ending date for wikipedia view data. format YYYYMMDD")
-    parser.add_argument("-v", "--verbosity", dest="verbosity_input", default=10,
+    parser.add_argument("-v", "--verbosity", dest="verbosity_input", type=int, default=10,
                         help="set output verbosity. 0 is silent, 10 is default, 100 is max.")
     parser.add_argument("-m", "--max", dest="max_rows", default=-1,
                         help="set max number of rows. -1 means no limit. useful when debugging.")
 
-    parser.add_argument("path", help="path to the .apkg file")
+    parser.add_argument("-f", "--fame-pack", dest="fame_pack_path", default="",
+                        help="path to a fame pack of precomputed fame data to use instead of fetching.")
+
+    parser.add_argument("--record", dest="record_path", default="",
+                        help="record every response to this cassette file, to replay the run later.")
+    parser.add_argument("--replay", dest="replay_path", default="",
+                        help="replay the responses recorded in this cassette file instead of using the network.")
+    parser.add_argument("--pace", action="store_true",
+                        help="when replaying, take as long as the recorded responses did.")
+
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="order every package without stopping to review the spreadsheet (implied by several packages).")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="how many packages to order at once in batch mode.")
+    parser.add_argument("--cache", dest="cache_path", default="",
+                        help="an SQLite file to cache responses in, shared by all packages.  Batch mode defaults to order_cache.sqlite.")
+    parser.add_argument("-r", "--rate", type=int, default=100,
+                        help="the most Wikipedia requests to send per second, across all packages.")
+
+    parser.add_argument("path", nargs="+", help="paths (or glob patterns) of the .apkg files")
     parser.add_argument("identifiers", help=
     """Input a JSON string indicating, for each note type, a list of fields to grab the identity from.  For example,
     a deck about US History might contain a note type for Presidents and a note type for Periods.  If you want
@@ -115,19 +184,76 @@ def parse_inputs():
 
     args = parser.parse_args()
 
-    global apkg_path, identifiers, start_date, end_date, verbosity_input, max_rows
-    apkg_path = args.path
+    global package_paths, identifiers, start_date, end_date, verbosity_input, max_rows, fame_pack_path, cassette_path, replay, pace
+    global batch, jobs, cache_path, rate
+    package_paths = []
+    for path in args.path:
+        package_paths += sorted(glob.glob(path)) if glob.has_magic(path) else [path]
     identifiers = args.identifiers
     start_date = args.start_date
     end_date = args.end_date
     verbosity_input = args.verbosity_input
-    max_rows = args.max_rows
+    max_rows = int(args.max_rows)
+    fame_pack_path = args.fame_pack_path
+    cassette_path = args.replay_path or args.record_path
+    replay = bool(args.replay_path)
+    pace = args.pace
+    batch = args.batch or len(package_paths) > 1
+    jobs = args.jobs
+    cache_path = args.cache_path or ("order_cache.sqlite" if batch else "")
+    rate = args.rate
+
+SETTINGS = ["identifiers", "start_date", "end_date", "verbosity_input", "max_rows", "fame_pack_path", "cache_path"]
+"""
+the inputs a batch worker process needs from the command line
+"""
+
+def open_shared(limiter_of_run, google_limiter_of_run):
+    """
+    Opens the cache and sets the rate limiters, which every deck ordered by this process shares.
+    """
+
+    global cache, limiter, google_limiter
+    cache = net.Cache(cache_path) if cache_path else None
+    limiter = limiter_of_run
+    google_limiter = google_limiter_of_run
+
+def init_worker(settings, limiter_of_run, google_limiter_of_run):
+    """
+    Sets up a batch worker process, which (with the "spawn" start method) has not parsed the command line.
+    """
+
+    globals().update(settings)
+    open_shared(limiter_of_run, google_limiter_of_run)
+
+def fetch_json(url: str):
+    """
+    Gets a URL's JSON body, from the cache if it has it, and otherwise through the rate limiter and the cassette if
+    one is open.
+    """
+
+    if cache is not None:
+        contents = cache.get(url)
+        if contents is not None:
+            return contents
+    if limiter is not None and not (tape is not None and tape.replaying):
+        limiter.acquire()
+
+    def fetch():
+        with request.urlopen(url) as resp:
+            return resp.status, resp.read()
+
+    _, body = fetch() if tape is None else tape.fetch(url, fetch)
+    contents = json.loads(body)
+    if cache is not None:
+        cache.put(url, contents)
+    return contents
 
 def get_pageviews(url_bit: str = ""):
     pageviews = 0
     wiki_url = "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/en.wikipedia.org"
     wiki_url += "/all-access/user/" + url_bit + "/monthly/" + start_date + "/" + end_date
-    contents = json.loads(request.urlopen(wiki_url).read())
+    contents = fetch_json(wiki_url)
     #print(json.dumps(json.loads(contents), indent=4))
     for item in contents["items"]:
         pageviews += item["views"]
@@ -139,12 +265,27 @@ def go_get_wiki_pv(max = max_rows, verbosity = 0):
         print()
         print("GETTING WIKIPEDIA PAGEVIEWS...")
         print("  No   URL bit                    Pageviews")
+    pack = famepack.FamePack(fame_pack_path) if fame_pack_path else None
+    if pack is not None and not pack.covers("en.wikipedia.org", start_date, end_date):
+        print("The fame pack's pageviews are for {} from {} to {}, not {} to {}; fetching them instead".format(
+            pack.project, pack.start, pack.end, start_date, end_date))
+        pack = None
     for i in range(max):
+        if pack is not None:
+            url_bit, pageviews, _ = pack.lookup(notes[i]["ident"])
+            if pageviews is not None:
+                notes[i]["url_bit"] = url_bit
+                notes[i]["wiki_urls"] = ["https://en.wikipedia.org/wiki/" + url_bit]
+                notes[i]["pageviews"] = pageviews
+                if verbosity >= 10:
+                    print('{:4d}'.format(i) + ":  " + '{:25.22}'.format(notes[i]["url_bit"]) + '{:>11.11}'.format(str(notes[i]["pageviews"])) + " (fame pack)")
+                continue
+
         # SEE https://stackoverflow.com/questions/27457977/searching-wikipedia-using-api
         wiki_search_url = "https://en.wikipedia.org/w/api.php?action=opensearch&search="
         wiki_search_url += notes[i]["ident"].replace(" ","+")
         wiki_search_url += "&limit=10&namespace=0&format=json"
-        search_result = json.loads(request.urlopen(wiki_search_url).read())
+        search_result = fetch_json(wiki_search_url)
         url_bit = os.path.basename(parse.urlparse(search_result[3][0]).path)
         notes[i]["url_bit"] = url_bit
         notes[i]["wiki_urls"] = copy.deepcopy(search_result[3])
@@ -181,34 +322,37 @@ def re_get_wiki_pv(max = max_rows, verbosity = 0):
                 notes[id]["url_bit"] = new_url
                 print(msg)
 
+def write_fame_pack(max = max_rows):
+    """
+    Writes the fame data gathered for the notes as a fame pack, so it can be shared and reused with -f.
+    """
+
+    writer = famepack.FamePackWriter("en.wikipedia.org", start_date, end_date)
+    if fame_pack_path:
+        writer.update(famepack.FamePack(fame_pack_path))
+    for i in range(max):
+        if "url_bit" in notes[i]:
+            writer.add(notes[i]["ident"], notes[i]["url_bit"], notes[i].get("pageviews"))
+    writer.write(apkg_path + "_ordering/ordering.fame")
+
 def go_get_google_hits(max = max_rows, verbosity = 0):
     if verbosity >= 10:
         print("GOOGLE HITS")
         print("  No   URL bit                        Google hits")
-    caps = DesiredCapabilities().FIREFOX
-    caps["pageLoadStrategy"] = "none"  #  interactive
-    driver = webdriver.Firefox(capabilities=caps)
-    driver.get("https://www.google.com")
-    button = WebDriverWait(driver, timeout=10).until(EC.element_to_be_clickable((By.ID, 'L2AGLb')))
-    #driver.find_element_by_id('L2AGLb').click()
-    button.click()
-    for i in range(max):
-        google_search_url = "https://www.google.com/search?q="
-        google_search_url += notes[i]["ident"].replace(" ","+")
-        driver.get(google_search_url)
-        WebDriverWait(driver, poll_frequency=0.02, timeout=10).until(EC.invisibility_of_element_located((By.ID,"result-stats")))
-        el = WebDriverWait(driver, timeout=10).until(lambda d: d.find_element(By.ID,"result-stats"))
-        match = re.search(r"About (.*) results .*", el.text)
-        #match = re.search(r"About (.*) results .*", driver.find_element_by_id('result-stats').text)
-        #driver.execute_script("window.stop();")
-        if match:
-            hits = match.group(1).replace(",","")
-            notes[i]["googlehits"] = int(hits)
-        else:
-            notes[i]["googlehits"] = -1
+
+    def on_done(i, hit_count):
+        notes[i]["googlehits"] = -1 if hit_count is None else hit_count
         if verbosity >= 10:
             print('{:4d}'.format(i) + ":  " + '{:25.22}'.format(notes[i]["ident"].replace(" ","+")) + '{:>11.11}'.format(str(notes[i]["googlehits"])))
 
+    # A pool of warm headless browsers; hits.HttpHitCounter is a lighter alternative
+    hits_cache = cache if cache is not None else net.Cache(apkg_path + "_ordering/cache.sqlite")
+    with hits.BrowserHitCounter(workers=google_workers, limiter=google_limiter or net.RateLimiter(google_workers, 1),
+                                cache=hits_cache, tape=tape) as counter:
+        counter.count_many([notes[i]["ident"] for i in range(max)], on_done=on_done)
+    if hits_cache is not cache:
+        hits_cache.close()
+
 def extract():
     with zipfile.ZipFile(apkg_path + "_ordered.apkg", 'r') as zip:
         zip.extractall(apkg_path + "_ordering/unzipped/")
@@ -235,7 +379,15 @@ def load_model(model_key = ""):
             lis.append({"nid": entry[0], "flds": flds})
     return lis
 
-def get_idents_from_db():
+def get_idents_from_db(strict = True):
+    """
+    Fills notes with the nid and (clean) ident of every note of the note types in identifiers.
+
+    :param strict: Stop if a note type in identifiers is not in the deck.  Otherwise (in batch mode, where one
+        identifiers string serves many decks) only stop if none of them is.
+    :return: The phrases.PhraseCleaner the idents were cleaned with
+    """
+
     # Build "ident_fields_of_model" dict {model key: list of ident field names}
     models = json.loads(cur.execute("SELECT models FROM col").fetchone()[0])
     for ident_key in identifiers.keys():
@@ -244,12 +396,15 @@ def get_idents_from_db():
             if models[model_key]["name"] == ident_key:
                 model_found = True
                 ident_fields_of_model[model_key] = identifiers[ident_key]
-        if not model_found:
+        if not model_found and strict:
             msg = "ERROR: Model name \"" + ident_key + "\" not found.  Model names: ["
             for key in models.keys():
                 msg += models[key]["name"] + ", "
             print(msg + "]")
             exit()
+    if not ident_fields_of_model:
+        print("ERROR: None of the model names " + str(list(identifiers.keys())) + " were found.")
+        exit()
 
     # Check field names can be found in respective models
     for model_key in ident_fields_of_model.keys():
@@ -283,13 +438,17 @@ def get_idents_from_db():
                     print("warn1: some ident name is empty string")
             notes.append({"nid": note["nid"], "ident": ident})
 
-        # for entry in res.fetchall():
-        #     ident = entry[1].split("\x1f")[field_no].replace('<br>','').replace('<br/>','').replace('<br />','')
-        #     notes.append({"nid": entry[0], "ident" : ident})
-    
+    # Strip HTML, entities and cloze markup from the idents, so that variants of a name share one search
+    cleaner = phrases.PhraseCleaner()
+    for note, ident in zip(notes, cleaner.clean_all(note["ident"] for note in notes)):
+        note["ident"] = ident
+    if verbosity_input >= 10:
+        print("{} distinct idents ({} variants merged by cleaning)".format(cleaner.distinct, cleaner.merged))
+
     if verbosity_input >= 20:
         for i in range(len(notes)):
             print('{:4d}'.format(i) + ": " + str(notes[i]))
+    return cleaner
 
 def write_scout_to_csv(max = max_rows):
     with open(apkg_path + "_ordering/ordering.csv","w",newline='') as csvfile:
@@ -313,55 +472,154 @@ def write_scout_to_csv(max = max_rows):
                     row += [os.path.basename(parse.urlparse(notes[i]["wiki_urls"][j]).path)]
             csvwriter.writerow(row)
 
-# START OF PROGRAM
+def order_deck(path, review = True):
+    """
+    Orders the notes of one package by fame, writing <deck>_ordered.apkg and a summary report,
+    <deck>_ordering/report.json.
 
-parse_inputs()
+    :param path: The .apkg file
+    :param review: Stop to let the user fix the Wikipedia articles in a spreadsheet (libreoffice --calc)
+    :return: The report
+    """
 
-# check path is valid
-print(apkg_path)
-if apkg_path[-5:] != ".apkg":
-    print("Invalid file path: does not end with .apkg")
-    exit()
-else:
-    apkg_path = apkg_path[:-5]
-identifiers = json.loads(identifiers)
+    global apkg_path, notes, ident_fields_of_model, cur
+    started = time.perf_counter()
+    apkg_path = path[:-5]
+    notes = []
+    ident_fields_of_model = {}
 
-shutil.copy(apkg_path + ".apkg", apkg_path + "_ordered.apkg")
-extract() # Extract APKG_PATH.apkg to folder APKG_PATH_ordering/unzipped/
+    shutil.copy(apkg_path + ".apkg", apkg_path + "_ordered.apkg")
+    extract() # Extract APKG_PATH.apkg to folder APKG_PATH_ordering/unzipped/
 
-with sqlite3.connect(apkg_path + "_ordering/unzipped/collection.anki2") as con:
-    cur = con.cursor()
-    get_idents_from_db() # Obtain idents from "notes" DB table
+    with sqlite3.connect(apkg_path + "_ordering/unzipped/collection.anki2") as con:
+        cur = con.cursor()
+        cleaner = get_idents_from_db(strict = review) # Obtain idents from "notes" DB table
 
-    if max_rows == -1:
-        max_rows = len(notes)
+        count = len(notes) if max_rows == -1 else min(max_rows, len(notes))
 
-    if get_wiki_pv:
-        go_get_wiki_pv(max_rows, verbosity = verbosity_input)
+        if get_wiki_pv:
+            go_get_wiki_pv(count, verbosity = verbosity_input)
 
-    if get_google_hits:
-        go_get_google_hits(max_rows, verbosity = verbosity_input)
+        if get_google_hits:
+            go_get_google_hits(count, verbosity = verbosity_input)
 
-    write_scout_to_csv(max_rows)
-    exec = "libreoffice --calc \"" + apkg_path + "_ordering/ordering.csv\""
-    os.system(exec)
+        write_scout_to_csv(count)
+        if review:
+            exec = "libreoffice --calc \"" + apkg_path + "_ordering/ordering.csv\""
+            os.system(exec)
 
-    if get_wiki_pv:
-        re_get_wiki_pv(max_rows, verbosity = verbosity_input)
+            if get_wiki_pv:
+                re_get_wiki_pv(count, verbosity = verbosity_input)
 
-    if get_google_hits:
-        # TO CODE THIS
-        pass
+            if get_google_hits:
+                # TO CODE THIS
+                pass
+
+        if get_wiki_pv:
+            write_fame_pack(count)
+
+        # Set notes table "due" column
+        columns = {
+            "pageviews": [d.get("pageviews") for d in notes],
+            # -1 means the search failed, which is not the same as no hits
+            "googlehits": [None if d.get("googlehits", -1) < 0 else d["googlehits"] for d in notes],
+            "age": [d["nid"] for d in notes],
+        }
+        order = scoring.rank(columns, weights, methods={"age": "percentile"})
+        cur.executemany("UPDATE cards SET due=(?) WHERE nid=(?)", ((i, notes[j]["nid"]) for i, j in enumerate(order)))
+    con.close()
+
+    # Zip apkg_name_ordered/unzipped
+    shutil.make_archive(apkg_path + "_ordered", 'zip', apkg_path + "_ordering/unzipped/")
+    os.replace(apkg_path + "_ordered.zip", apkg_path + "_ordered.apkg")
+
+    report = {
+        "package": path,
+        "output": apkg_path + "_ordered.apkg",
+        "notes": len(notes),
+        "searched": count,
+        "distinct_idents": cleaner.distinct,
+        "idents_merged_by_cleaning": cleaner.merged,
+        "with_pageviews": sum(1 for d in notes if d.get("pageviews")),
+        "with_googlehits": sum(1 for d in notes if d.get("googlehits", -1) >= 0),
+        "seconds": round(time.perf_counter() - started, 1),
+        "most_famous": [notes[j]["ident"] for j in order[:10]],
+    }
+    with open(apkg_path + "_ordering/report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+def order_batch():
+    """
+    Orders every package in a process pool, without the spreadsheet review.  The processes share one response cache
+    (cache_path) and one rate limit, and a deck that fails does not stop the others.
 
-    # Set notes table "due" column
-    sorted_notes = sorted(notes, key=lambda d: -d["pageviews"])
-    for i in range(len(sorted_notes)):
-        cur.execute("UPDATE cards SET due=(?) WHERE nid=(?)", (i, sorted_notes[i]["nid"]))
-con.close()
+    :return: How many decks failed
+    """
 
-# Zip apkg_name_ordered/unzipped
-shutil.make_archive(apkg_path + "_ordered", 'zip', apkg_path + "_ordering/unzipped/")
-os.rename(apkg_path + "_ordered.zip", apkg_path + "_ordered.apkg")
+    settings = {name: globals()[name] for name in SETTINGS}
+    # The worker processes would all print at once, so they only print errors; their reports say the rest
+    settings["verbosity_input"] = 0
+    shared = (net.SharedRateLimiter(rate, 1), net.SharedRateLimiter(google_workers, 1))
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(package_paths)), initializer=init_worker,
+                                                initargs=(settings,) + shared) as pool:
+        futures = {pool.submit(order_deck, path, False): path for path in package_paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                report = future.result()
+            except SystemExit:
+                # order_deck has printed why
+                failed += 1
+                print("FAILED: " + futures[future])
+                continue
+            except Exception as err:
+                failed += 1
+                print("FAILED: {}: {!r}".format(futures[future], err))
+                continue
+            if verbosity_input >= 1:
+                print("{package}: {notes} notes, {with_pageviews} with pageviews, {seconds}s -> {output}".format(**report))
+    return failed
+
+def main():
+    global identifiers, tape
+
+    parse_inputs()
+
+    # check paths are valid
+    for path in package_paths:
+        if path[-5:] != ".apkg":
+            print("Invalid file path: does not end with .apkg: " + path)
+            exit()
+    if not package_paths:
+        print("No packages found")
+        exit()
+    identifiers = json.loads(identifiers)
+
+    if batch:
+        if cassette_path:
+            print("--record and --replay work with one package at a time")
+            exit()
+        failed = order_batch()
+        if verbosity_input >= 1:
+            print("\nOrdered {} of {} packages (reports in each <deck>_ordering/report.json)".format(
+                len(package_paths) - failed, len(package_paths)))
+        sys.exit(1 if failed else 0)
+
+    print(package_paths[0])
+    if cassette_path:
+        tape = cassette.Cassette(cassette_path, "replay" if replay else "record", pace=pace)
+    open_shared(net.RateLimiter(rate, 1), None)
+    order_deck(package_paths[0])
+    if tape is not None:
+        tape.close()
+    if cache is not None:
+        cache.close()
+
+    if verbosity_input >= 1:
+        print("\nDone")
+
+# START OF PROGRAM
 
-if verbosity_input >= 1:
-    print("\nDone")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Record/replay "cassettes" of HTTP traffic, so that a run can be reproduced later with no network.
+
+Recording keeps every response (status, body and how long it took) by request key, usually the URL.  On close, the
+responses are written as a sortedtable of zlib-compressed records, so replaying memory-maps the file and looks each
+request up in O(log n):
+
+    MAGIC | sortedtable of key -> zlib(status (uint16) | elapsed seconds (float64) | body)
+
+Replay is instant by default, or paced to the recorded latencies:
+
+    with Cassette("run.cassette", "record") as tape:
+        body = tape.fetch(url, lambda: fetch(url))  # fetch returns (status, body)
+    with Cassette("run.cassette", "replay", pace=True) as tape:
+        body = tape.fetch(url, lambda: fetch(url))  # never calls fetch
+
+Requests that failed without a response (timeouts, refused connections) are not recorded, and replay as CassetteMiss.
+"""
+
+import mmap
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Tuple
+
+try:
+    from . import sortedtable
+except ImportError: # Running this module by itself for dev purposes
+    import sortedtable
+
+MAGIC = b"OAKCAS01"
+_entry = struct.Struct("<Hd")
+
+
+class CassetteMiss(KeyError):
+    """
+    Raised when replaying a request that the cassette has no response for.
+    """
+
+
+class Cassette:
+    """
+    A cassette file, opened for recording or for replay.  Thread-safe.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", pace: bool = False) -> None:
+        """
+        :param path: The cassette file.  Recording overwrites it on close.
+        :param mode: "record" or "replay"
+        :param pace: When replaying, wait as long as each response originally took
+        """
+
+        if mode not in ("record", "replay"):
+            raise ValueError("Unknown cassette mode: {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.pace = pace
+        self._lock = threading.Lock()
+        self._recorded: Dict[str, bytes] = {}
+        self._file = None
+        self._mm = None
+        if self.replaying:
+            self._file = open(path, "rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mm[:len(MAGIC)] != MAGIC:
+                self.close()
+                raise ValueError("{} is not a cassette".format(path))
+            self._table = sortedtable.Table(self._mm, len(MAGIC))
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def fetch(self, key: str, fetch: Callable[[], Tuple[int, bytes]]) -> Tuple[int, bytes]:
+        """
+        Returns the (status, body) response for a request: from the cassette when replaying, or from fetch (and
+        recorded) when recording.  Only the first response for a key is kept.
+
+        :param key: What identifies the request, e.g. its URL with query parameters
+        :param fetch: Sends the request, returning (status, body)
+        :return: The (status, body) response
+        """
+
+        if self.replaying:
+            return self.play(key)
+        start = time.monotonic()
+        status, body = fetch()
+        self.record(key, status, body, time.monotonic() - start)
+        return status, body
+
+    def play(self, key: str) -> Tuple[int, bytes]:
+        """
+        Returns the recorded (status, body) response for key, paced if asked to.  Raises CassetteMiss if there is none.
+        """
+
+        value = self._table.get(key.encode("utf-8"))
+        if value is None:
+            raise CassetteMiss(key)
+        record = zlib.decompress(value)
+        status, elapsed = _entry.unpack_from(record, 0)
+        if self.pace:
+            time.sleep(elapsed)
+        return status, record[_entry.size:]
+
+    def record(self, key: str, status: int, body: bytes, elapsed: float) -> None:
+        """
+        Records a response, unless key already has one.
+        """
+
+        with self._lock:
+            if key not in self._recorded:
+                self._recorded[key] = zlib.compress(_entry.pack(status, elapsed) + body)
+
+    def __len__(self) -> int:
+        return len(self._table) if self.replaying else len(self._recorded)
+
+    def close(self) -> None:
+        """
+        Writes the cassette (when recording) or lets go of it (when replaying).
+        """
+
+        if self.replaying:
+            if self._mm is not None:
+                self._mm.close()
+                self._file.close()
+                self._mm = self._file = None
+            return
+        with self._lock:
+            records = sorted((key.encode("utf-8"), value) for key, value in self._recorded.items())
+        with open(self.path, "wb") as f:
+            f.write(MAGIC)
+            sortedtable.write_table(f, records)
+
+    def __enter__(self) -> 'Cassette':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
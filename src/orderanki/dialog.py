@@ -0,0 +1,541 @@
+from math import ceil
+from aqt import mw, AnkiQt
+from aqt.utils import qconnect, tooltip, showWarning, showInfo
+from aqt.qt import *
+from anki.notes import NoteId, Note
+from anki.models import NotetypeDict, NotetypeId, ModelManager
+from aqt.fields import *
+
+import concurrent.futures
+import html
+import os
+import re
+from typing import Dict, Sequence, Optional, Union, List
+
+from . import engine, hits, net, phrases, refresh, scoring, wiki
+from urllib import parse
+import requests
+
+TESTING = False
+FAME_PACK_NAME = "fame_pack.fame"
+PREVIEW_NOTES = 5
+"""
+How many of the selected notes the live preview resolves (and so fetches ahead of pressing OK)
+"""
+PREVIEW_DELAY_MS = 600
+"""
+How long the template must be left alone before the preview fetches
+"""
+
+class AddFameDialog(QDialog):
+    """
+    The class for the Add Fame dialog.
+    """
+
+    def __init__(self, browser: QMainWindow, nids : Sequence[NoteId]) -> None:
+        """
+        Initialise the pop-up window for Adding Fame.
+
+        :param browser: A QMainWindow object for the browser
+        :param nids: A Sequence[NoteId] object for adding fame to
+        """
+
+        QDialog.__init__(self, parent=browser)
+        self.browser: QMainWindow = browser
+        self.nids = nids
+        self.nid = self.nids[0]
+        self.bmw: AnkiQt = self.browser.mw
+        note: Note = self.bmw.col.get_note(self.nid)
+        self.exampleNote = note
+        self.previewNotes: Optional[List[Note]] = None
+        self.previewNo = 0
+        self.model: Optional[NotetypeDict] = note.note_type()
+        self.fields = self.bmw.col.models.field_names(self.model)
+
+        # The live preview shares its calls between notes with identical search phrases (or resolving to the same
+        # article).  The engine shares only the calls in flight during a run, so these hold the preview's results only.
+        wiki.search_flight.clear()
+        wiki.article_flight.clear()
+
+        # Fill from a shared fame pack instead of fetching, if the user has put one in user_files
+        packPath = os.path.join(net.USER_FILES, FAME_PACK_NAME)
+        wiki.load_fame_pack(packPath if os.path.exists(packPath) else None)
+
+        self._setupUi()
+
+    def _handleNetworkError(self, err: Exception, msg: str = "") -> None:
+        if isinstance(err, requests.HTTPError):
+            txt = str(err)
+        else:
+            txt = tr.addons_please_check_your_internet_connection() + "\n\nError: " + str(err)
+        showWarning(msg + "\n\n" + txt, textFormat="rich", parent=self)
+
+    def _mergeFieldIntoTag(self, mergeString: str, note: Union[Note, Dict[str, str]]) -> str:
+        """
+        Merge the tags from a given Note into a merge String.
+
+        :param mergeString:  The string containing merge tags
+        :param note:  The note, or its fields (see scoring.iter_fields)
+        """
+
+        mergeResult = ""
+        mergeRe = r"\{\{[^\{].*?\}\}"
+        se = re.search(mergeRe, mergeString)
+        while se is not None:
+            fieldName = se.group()[2:-2]
+            # note = mw.col.get_note(self.nid)
+            noteValues = [item for item in note.items() if item[0] == fieldName]
+            if len(noteValues) >= 1:
+                mergeResult += mergeString[0:se.span()[0]] + str(noteValues[0][1])
+            else:
+                mergeResult += mergeString[0:se.span()[1]]
+            mergeString = mergeString[se.span()[1]:]
+            se = re.search(mergeRe, mergeString)
+        mergeResult += mergeString
+        return mergeResult
+
+    def _getFields(self) -> List[str]:
+        """
+        Returns a list of field names for the model that the notes are based on.
+
+        :return: A list of field names for the notes' model
+        """
+
+        return self.bmw.col.models.fieldNames(self.model)
+
+    # See https://github.com/ankitects/anki/blob/d110c4916cf1d83fbeae48ae891515c79a412018/qt/aqt/fields.py#L142
+    def _uniqueName(self, txt: str, ignoreOrd: Optional[int] = None) -> Optional[str]:
+        """
+        Deals with the newly created fields having a unique name.
+        """
+
+        if not txt:
+            return None
+        if txt[0] in "#^/":
+            showWarning(tr.fields_name_first_letter_not_valid())
+            return None
+        for letter in """:{"}""":
+            if letter in txt:
+                showWarning(tr.fields_name_invalid_letter())
+                return None
+        for f in self.model["flds"]:
+            if ignoreOrd is not None and f["ord"] == ignoreOrd:
+                continue
+            if f["name"] == txt:
+                showWarning(tr.fields_that_field_name_is_already_used())
+                return None
+        return txt
+
+    # See https://github.com/ankitects/anki/blob/d110c4916cf1d83fbeae48ae891515c79a412018/qt/aqt/fields.py#L179
+    def _provisionFields(self, fieldNames: List[str]) -> bool:
+        """
+        Adds whichever of fieldNames the model lacks, all in one notetype update (so one schema change, and the
+        model's notes are rewritten once), and waits for the update to finish.
+
+        :param fieldNames: The fields the notes need
+        :return: True if all the fields now exist, False if the user declined the schema change or a name was invalid
+        """
+
+        existing = set(self.bmw.col.models.field_names(self.model))
+        missing = [name for name in dict.fromkeys(fieldNames) if name not in existing]
+        if not missing:
+            return True
+        for name in missing:
+            if not self._uniqueName(name):
+                return False
+        if not ChangeTracker(self.bmw).mark_schema():
+            return False
+
+        mm = ModelManager(self.bmw.col)
+        for name in missing:
+            mm.add_field(self.model, mm.new_field(name))
+
+        # Wait on the update's callback (keeping the UI responsive) rather than sleeping and hoping it has finished
+        loop = QEventLoop()
+        succeeded = False
+
+        def on_done(changes: OpChanges) -> None:
+            nonlocal succeeded
+            succeeded = True
+            loop.quit()
+
+        def on_failure(err: Exception) -> None:
+            showWarning(str(err), parent=self)
+            loop.quit()
+
+        update_notetype_legacy(parent=self.bmw, notetype=self.model).success(on_done).failure(on_failure).run_in_background()
+        loop.exec()
+        if succeeded:
+            tooltip("New fields added: " + ", ".join(missing), parent=self.parentWidget())
+        return succeeded
+
+    def accept(self) -> None:
+        """
+        When the OK button in the Dialog is clicked, start adding the Fame.
+        """
+
+        addWiki = self.fDict[0]["gb"].isChecked()
+        addGoogle = self.fDict[1]["gb"].isChecked()
+        fieldName = self.fDict[0]["useFieldName"].text()
+        useSitelinks = self.sitelinksCheck.isChecked()
+        topN = self.topSpin.value() if useSitelinks else 0
+        googleFieldName = self.fDict[1]["useFieldName"].text()
+
+        if addWiki:
+            # Check if we have a connection to Wikipedia.
+            try:
+                wiki.search_article_url("Noodles")
+            except requests.RequestException as err:
+                self._handleNetworkError(err)
+                return
+
+        # Add every missing field in one go
+        neededFields = []
+        if addWiki:
+            neededFields += [fieldName, fieldName + " (URL)", fieldName + " (Description)", fieldName + " (URL fixed)"]
+            if useSitelinks:
+                neededFields.append(fieldName + " (Sitelinks)")
+        if addGoogle:
+            neededFields.append(googleFieldName)
+        if not self._provisionFields(neededFields):
+            return
+
+        # Add wikipedia fame?
+        if addWiki:
+            CONNECTIONS = 100
+            RATE = 100
+            PER = 1
+            TIMEOUT = 5
+            HEDGE_BUDGET = 0.05 # Re-send at most 5% of requests, when they are slower than the recent p95
+
+            # Setup Progress Dialog
+            progress = QProgressDialog("Adding Wikipedia Pageviews...", "Stop", 0, len(self.nids), self)
+            progress.setWindowModality(Qt.WindowModal)
+            progress.setMinimumDuration(0)
+            progress.setMinimumSize(300,30)
+
+            self.previewTimer.stop()
+            self.previewNo += 1 # Ignore any preview still in flight
+            phraseKeys = set()
+            cleaner = phrases.PhraseCleaner(strip_cloze=self.clozeCheck.isChecked())
+
+            mergeString = self.fDict[0]["edit"].toPlainText()
+
+            def phrase_for(fields: Dict[str, str]) -> str:
+                search_phrase = cleaner.clean(self._mergeFieldIntoTag(mergeString, fields))
+                phraseKeys.add(wiki.normalize_phrase(search_phrase))
+                return search_phrase
+
+            # Record when each note's pageviews were fetched, for the background refresher
+            fameAges = refresh.openAges()
+            fetched = []
+
+            def on_written(wf: wiki.Wikifame) -> None:
+                if isinstance(wf.pageviews, int):
+                    fetched.append((refresh.agesKey(wf.nid, fieldName), wf.pageviews))
+
+            def on_progress(stats: engine.FameStats) -> bool:
+                progress.setValue(stats.done)
+                if len(fetched) >= 1000:
+                    fameAges.put_many(fetched)
+                    fetched.clear()
+                return progress.wasCanceled()
+
+            def runEngine(nids: Sequence[NoteId], metrics: Sequence[str], reuseArticles: bool = False) -> engine.FameStats:
+                # Notes stream through the engine, so memory depends on CONNECTIONS rather than on the selection size
+                fameEngine = engine.FameEngine(self.bmw, nids, phrase_for, fieldName, project="en.wikipedia.org",
+                    connections=CONNECTIONS, rate=RATE, per=PER, timeout=TIMEOUT, metrics=metrics, on_written=on_written,
+                    hedge_budget=HEDGE_BUDGET, reuse_articles=reuseArticles)
+                progress.setMaximum(len(nids))
+                progress.setValue(0)
+                stats = fameEngine.run(on_progress)
+                progress.setValue(progress.maximum())
+                return stats
+
+            # Most urgent notes first, so a stopped run leaves its gaps where they matter least
+            nids = engine.priority_order(self.bmw.col, self.nids, engine.ORDERS[self.orderSelect.currentIndex()], fieldName)
+            pageviewNids = nids
+            msg = ""
+            if useSitelinks:
+                # Sitelinks cost 2 requests per 50 notes, so get them for every note first, and spend the pageview
+                # requests (one per note) on the notes with the most sitelinks only
+                progress.setLabelText("Adding Wikidata sitelinks...")
+                sitelinkStats = runEngine(nids, ("sitelinks",))
+                msg += "Added sitelinks for {} out of {} selected notes.<br>".format(sitelinkStats.populated, len(self.nids))
+                if sitelinkStats.cancelled:
+                    pageviewNids = []
+                elif 0 < topN < len(self.nids):
+                    sitelinksField = fieldName + " (Sitelinks)"
+                    columns = scoring.read_columns(self.bmw.col, self.nids, [sitelinksField])
+                    order = scoring.rank(columns, {sitelinksField: 1})
+                    top = {self.nids[i] for i in order[:topN]}
+                    pageviewNids = [nid for nid in nids if nid in top]
+                progress.setLabelText("Adding Wikipedia Pageviews...")
+
+            # The sitelinks run has just searched these notes, so their articles are reused rather than searched again
+            stats = runEngine(pageviewNids, ("pageviews", "desc"), reuseArticles=useSitelinks)
+            fameAges.put_many(fetched)
+            fameAges.close()
+            msg += "Added Pageview data for {} out of {} selected notes. {} errors".format(stats.populated,len(self.nids),stats.errors)
+            msg += "<br>({} distinct search phrases were searched; cleaning merged {} more.)".format(len(phraseKeys), cleaner.merged)
+            msg += "<br>{} notes changed, {} were already up to date.".format(stats.changed, stats.unchanged)
+            showInfo(msg, textFormat="rich", parent=self)
+
+        # Add Google hits?
+        if addGoogle:
+            GOOGLE_WORKERS = 4
+
+            mergeString = self.fDict[1]["edit"].toPlainText()
+            # One query per chunk of notes; only the notes whose hits changed are loaded
+            googleCleaner = phrases.PhraseCleaner(strip_cloze=self.clozeCheck.isChecked())
+            googleNids = []
+            currentHits = []
+            searchPhrases = []
+            for nid, fields in scoring.iter_fields(self.bmw.col, self.nids):
+                googleNids.append(nid)
+                currentHits.append(fields.get(googleFieldName))
+                searchPhrases.append(googleCleaner.clean(self._mergeFieldIntoTag(mergeString, fields)))
+            changedNotes = []
+
+            progress = QProgressDialog("Adding Google hits...", "Stop", 0, len(googleNids), self)
+            progress.setWindowModality(Qt.WindowModal)
+            progress.setMinimumDuration(0)
+            progress.setMinimumSize(300,30)
+            hitsFound = 0
+            hitsChanged = 0
+
+            def on_hits(i: int, hitCount: Optional[int]) -> bool:
+                nonlocal hitsFound, hitsChanged
+                if hitCount is not None:
+                    hitsFound += 1
+                    # Only write notes whose hit count changed, so reruns do not touch the collection
+                    if currentHits[i] != str(hitCount):
+                        hitsChanged += 1
+                        note = self.bmw.col.get_note(googleNids[i])
+                        note[googleFieldName] = str(hitCount)
+                        changedNotes.append(note)
+                        if len(changedNotes) >= 1000:
+                            self.bmw.col.update_notes(changedNotes)
+                            changedNotes.clear()
+                progress.setValue(progress.value() + 1)
+                return progress.wasCanceled()
+
+            cache = net.user_cache()
+            with hits.HttpHitCounter(workers=GOOGLE_WORKERS, limiter=net.RateLimiter(GOOGLE_WORKERS, 1), cache=cache) as counter:
+                counter.count_many(searchPhrases, on_done=on_hits)
+            cache.close()
+            if changedNotes:
+                self.bmw.col.update_notes(changedNotes)
+            progress.setValue(progress.maximum())
+            msg = "Added Google hits for {} out of {} selected notes.".format(hitsFound, len(googleNids))
+            msg += "<br>{} notes changed, {} were already up to date.".format(hitsChanged, hitsFound - hitsChanged)
+            showInfo(msg, textFormat="rich", parent=self)
+
+        self.close()
+
+    def _prefetch(self) -> None:
+        """
+        Resolves the first few selected notes in the background with the current template, and shows their article,
+        pageviews and description in the preview.  Runs once the template has been left alone for PREVIEW_DELAY_MS.
+        """
+
+        mergeString = self.fDict[0]["edit"].toPlainText()
+        if not mergeString.strip():
+            self.fDict[0]["preview"].setText("")
+            return
+        if self.previewNotes is None:
+            self.previewNotes = [self.bmw.col.get_note(nid) for nid in self.nids[:PREVIEW_NOTES]]
+        cleaner = phrases.PhraseCleaner(strip_cloze=self.clozeCheck.isChecked())
+        searchPhrases = [cleaner.clean(self._mergeFieldIntoTag(mergeString, note)) for note in self.previewNotes]
+        self.previewNo += 1
+        previewNo = self.previewNo
+        self.fDict[0]["preview"].setText("<i>Looking up...</i>")
+        self.bmw.taskman.run_in_background(lambda: self._resolvePreview(searchPhrases),
+            lambda future: self._showPreview(previewNo, future))
+
+    @staticmethod
+    def _resolvePreview(searchPhrases: List[str]) -> List[tuple]:
+        """
+        Looks up (search phrase, article, pageviews, description) for each search phrase, through the shared calls the
+        engine uses.  Runs on a background thread.
+        """
+
+        def lookUp(phrase: str) -> tuple:
+            try:
+                article = wiki.shared_search_article_url(phrase)
+            except (requests.RequestException, ValueError):
+                return phrase, "ERROR", "", ""
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                pageviews = executor.submit(wiki.shared_get_pageviews, article)
+                desc = executor.submit(wiki.shared_get_desc1, article)
+                try:
+                    return phrase, article, pageviews.result(), desc.result()
+                except (requests.RequestException, ValueError):
+                    return phrase, article, "ERROR", ""
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(searchPhrases), 1)) as executor:
+            return list(executor.map(lookUp, searchPhrases))
+
+    def _showPreview(self, previewNo: int, future: concurrent.futures.Future) -> None:
+        """
+        Shows the results of _resolvePreview, unless the template has changed (or OK was pressed) since.
+        """
+
+        if previewNo != self.previewNo or not self.isVisible():
+            return
+        try:
+            rows = future.result()
+        except Exception as err:
+            self.fDict[0]["preview"].setText("<b>Preview:</b> " + html.escape(str(err)))
+            return
+        msg = "<b>Preview:</b><table>"
+        for phrase, article, pageviews, desc in rows:
+            if not article:
+                title = "(no article)"
+            else:
+                title = article if article == "ERROR" else parse.unquote(article).replace("_", " ")
+            msg += "<tr><td>{}</td><td>&rarr; {}</td><td align=right>{}</td><td><i>{}</i></td></tr>".format(
+                html.escape(phrase), html.escape(title), html.escape(str(pageviews)), html.escape(desc or ""))
+        msg += "</table>"
+        self.fDict[0]["preview"].setText(msg)
+
+    def _setupUi(self) -> None:
+        """
+        Sets up the UI for the Add Fame dialog.
+        """
+
+        def _insertField(i: int) -> None:
+            """
+            Inserts the selected field wrapped in "{{ }}" to act as a merge tag.
+
+            :param i: An int, the index of the field selected.
+            """
+
+            if self.fDict[i]["insertSelect"].currentIndex() != 0:
+                self.fDict[i]["edit"].insertPlainText("{{"+self.fDict[i]["insertSelect"].currentText()+"}}")
+                self.fDict[i]["insertSelect"].setCurrentIndex(0)
+            self.fDict[i]["edit"].setFocus()
+
+        def _updateExample(i: int) -> None:
+            """
+            Generate and update the "Example" string under the textbox by merging with merge tags.
+
+            :param i: 0 = Wiki, 1 = Google
+            """
+
+            mergeString = self.fDict[i]["edit"].toPlainText()
+            msg = "<b>Example:</b> " + self._mergeFieldIntoTag(mergeString, self.exampleNote)
+            self.fDict[i]["example"].setTextFormat(Qt.RichText)
+            self.fDict[i]["example"].setText(msg)
+            if i == 0:
+                # Debounce: only prefetch once the template has been left alone for a moment
+                self.previewTimer.start()
+        
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(PREVIEW_DELAY_MS)
+        self.previewTimer.timeout.connect(self._prefetch)
+
+        main_vbox = QVBoxLayout()
+        if True:
+            ivbox = QVBoxLayout()
+            desc_msg = "Add fields containing the number of Wikipedia pageviews "
+            desc_msg+= "for an article (the first that Wikipedia search returns) and/or "
+            desc_msg+= "the number of Google hits for a search term.  Note: ensure no field begins with '{'."
+            desc_msg+= "Note: A super weird bug prevents proper function when only 1 card is selected."
+            desc = QLabel(desc_msg)
+            desc.setWordWrap(True)
+            ivbox.addWidget(desc)
+            selno = QLabel("<b>Notes selected:</b> " + str(len(self.nids)))
+            ivbox.addWidget(selno)
+            #ivbox.insertStretch(1, stretch=1)
+
+            fDictNo = 2
+            self.fDict = [{} for a in range(fDictNo)]
+            self.fDict[0]["gbName"] = "Get Wikipedia pageviews"
+            self.fDict[1]["gbName"] = "Get Google hits"
+            self.fDict[0]["newFieldPlaceholder"] = "Wiki Pageviews"
+            self.fDict[1]["newFieldPlaceholder"] = "Google Hits"
+
+            for i in range(2):
+                fd = self.fDict[i]
+                fd["gb"] = QGroupBox(fd["gbName"])
+                fd["gb"].setCheckable(True)
+                if i == 1:
+                    # Google hits are opt-in: Google rate-limits scraping much harder than Wikipedia
+                    fd["gb"].setChecked(False)
+                if True:
+                    fd["vbox"] = QVBoxLayout()
+                    if True:
+                        fd["insertField"] = QFormLayout()
+                        if True:
+                            fd["insertSelect"] = QComboBox()
+                            fd["insertSelect"].addItems(["SELECT FIELD"] + self.fields)
+                            fd["insertSelect"].currentIndexChanged.connect(lambda _, x = i: _insertField(x))
+                        fd["insertField"].addRow(QLabel("Insert field:"), fd["insertSelect"])
+                        fd["edit"] = QPlainTextEdit()
+                        if TESTING and i == 0:
+                            fd["edit"].insertPlainText("{{Name}}")
+
+                        fd["example"] = QLabel("<b>Example:</b> ")
+                        fd["example"].setWordWrap(True)
+                        fd["preview"] = QLabel("")
+                        fd["preview"].setTextFormat(Qt.RichText)
+                        fd["preview"].setWordWrap(True)
+                        fd["useField"] = QFormLayout()
+                        if True:
+                            fd["useFieldName"] = QLineEdit()
+                            fd["useFieldName"].setText(fd["newFieldPlaceholder"])
+                            #fd["useFieldName"].currentIndexChanged.connect(lambda _, x = i: _insertField(x))
+                        fd["useField"].addRow(QLabel("Add Fame into Field:"), fd["useFieldName"])
+                    fd["vbox"].addLayout(fd["insertField"])
+                    fd["vbox"].addWidget(fd["edit"])
+                    fd["vbox"].addWidget(fd["example"])
+                    if i == 0:
+                        # Shared by both searches; HTML and entities are always cleaned out of search phrases
+                        self.clozeCheck = QCheckBox("Remove cloze markup from search phrases")
+                        self.clozeCheck.setChecked(True)
+                        self.clozeCheck.toggled.connect(lambda _: self.previewTimer.start())
+                        fd["vbox"].addWidget(self.clozeCheck)
+                        fd["vbox"].addWidget(fd["preview"])
+                        self.sitelinksCheck = QCheckBox("Also add Wikidata sitelinks (fast: 2 requests per 50 notes)")
+                        self.topSpin = QSpinBox()
+                        self.topSpin.setRange(0, 10000000)
+                        self.topSpin.setSpecialValueText("All notes")
+                        self.topSpin.setToolTip("Rank the notes by sitelinks first, and only get pageviews for this many of the top notes")
+                        self.topSpin.setEnabled(False)
+                        self.sitelinksCheck.toggled.connect(self.topSpin.setEnabled)
+                        fd["vbox"].addWidget(self.sitelinksCheck)
+                        topForm = QFormLayout()
+                        topForm.addRow(QLabel("Get pageviews for the top:"), self.topSpin)
+                        fd["vbox"].addLayout(topForm)
+                        self.orderSelect = QComboBox()
+                        self.orderSelect.addItems(["In selection order", "Cards due soonest first",
+                                                   "By new card position", "Empty fame fields first"])
+                        self.orderSelect.setToolTip("Which notes to do first, so that a stopped run has done the ones that matter")
+                        orderForm = QFormLayout()
+                        orderForm.addRow(QLabel("Process notes:"), self.orderSelect)
+                        fd["vbox"].addLayout(orderForm)
+                    fd["vbox"].addLayout(fd["useField"])
+                fd["gb"].setLayout(fd["vbox"])
+                fd["edit"].textChanged.connect(lambda x = i: _updateExample(x))
+
+            buttonBox = QDialogButtonBox(Qt.Horizontal, self)
+            doneButton = buttonBox.addButton(QDialogButtonBox.StandardButton.Ok)
+            cancelButton = buttonBox.addButton(QDialogButtonBox.StandardButton.Cancel)
+            helpButton = buttonBox.addButton(QDialogButtonBox.StandardButton.Help)
+            doneButton.setToolTip("Begin adding fame...")
+            doneButton.clicked.connect(lambda _: self.accept())
+            cancelButton.clicked.connect(self.reject)
+
+        main_vbox.addLayout(ivbox)
+        main_vbox.addWidget(self.fDict[0]["gb"])
+        main_vbox.addWidget(self.fDict[1]["gb"])
+        main_vbox.addWidget(buttonBox)
+
+        self.setLayout(main_vbox)
+        self.fDict[0]["edit"].setFocus()
+        self.setMinimumWidth(540)
+        self.setMinimumHeight(550)
+        self.resize(540,550)
+        self.setWindowTitle("Add Fame...")
@@ -0,0 +1,335 @@
+"""
+The engine that adds Wikipedia fame to notes: search -> (pageviews, description, sitelinks) -> write.
+
+Work streams through the engine: Wikifames are made lazily from the nid list, at most window notes are in flight at
+once (a new note is only admitted when an earlier one has been written), and the notes' fields are read a chunk at a
+time with one query each (scoring.iter_fields).  Only notes whose fame changed are loaded, and each batch of them is
+updated with one update_notes call.  For the length of a run, the shared calls (wiki.search_flight and
+wiki.article_flight) only share calls in flight rather than keeping every result, so peak memory depends on the
+window, not on the size of the selection.
+
+Every task (search or fill) is queued with its note's position in nids as its priority, so the notes in flight are
+finished before later notes are searched.  Put the notes that matter most first (see priority_order) and a cancelled
+run leaves its gaps at the end rather than scattered across the deck.
+"""
+
+import concurrent.futures
+import heapq
+import itertools
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import net, scoring, wiki
+
+if TYPE_CHECKING:
+    from anki.collection import Collection
+    from anki.notes import NoteId
+    from aqt import AnkiQt
+
+ORDERS = ("selection", "due", "new", "empty")
+"""
+The orders priority_order can put notes in
+"""
+
+
+def priority_order(col: 'Collection', nids: Sequence['NoteId'], order: str, field_name: Optional[str] = None) -> List['NoteId']:
+    """
+    Sorts notes by how soon their fame is needed.  Ties keep their selection order.
+
+    :param col: The collection
+    :param nids: The notes, in selection order
+    :param order: "selection" keeps the order.  "due" puts the notes whose cards are due soonest first: review and
+        learning cards by due day, then new cards by queue position, then suspended and buried cards.  "new" puts
+        notes by the queue position of their new cards, then the rest.  "empty" puts notes with an empty field_name
+        first.
+    :param field_name: The pageviews field, for "empty"
+    :return: The notes, most urgent first
+    """
+
+    if order == "selection":
+        return list(nids)
+    if order == "empty":
+        if field_name is None:
+            raise ValueError("Ordering by empty fields needs a field name")
+        values = scoring.read_columns(col, nids, [field_name])[field_name]
+        return [nid for _, nid in sorted(zip(values, nids), key=lambda row: bool(row[0] and row[0].strip()))]
+    if order not in ("due", "new"):
+        raise ValueError("Unknown order: {}".format(order))
+
+    # The key of a note is the key of its most urgent card; notes without cards keep (3, 0)
+    keys: Dict['NoteId', Tuple[int, int]] = {}
+    ids = "({})".format(",".join(str(nid) for nid in nids))
+    for nid, queue, due in col.db.execute("select nid, queue, due from cards where nid in " + ids):
+        if order == "new":
+            key = (0, due) if queue == 0 else (1, 0)
+        elif queue in (2, 3):
+            key = (0, due)
+        elif queue == 1:
+            # Intraday learning cards are due by timestamp; they are due today
+            key = (0, (due - col.crt) // 86400)
+        elif queue == 0:
+            key = (1, due)
+        else:
+            key = (2, 0)
+        if nid not in keys or key < keys[nid]:
+            keys[nid] = key
+    return sorted(nids, key=lambda nid: keys.get(nid, (3, 0)))
+
+
+class PriorityExecutor:
+    """
+    A thread pool whose queue is a priority queue: the waiting task with the lowest priority runs first, and tasks
+    with the same priority run in the order they were submitted.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._queue: List[Tuple[Any, int, concurrent.futures.Future, Callable, tuple, dict]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._idle = 0
+        self._shutdown = False
+
+    def submit(self, priority: Any, fn: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Queues fn(*args, **kwargs) to run with the given priority.
+
+        :return: The future of its result
+        """
+
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            heapq.heappush(self._queue, (priority, next(self._seq), future, fn, args, kwargs))
+            if self._idle:
+                self._cond.notify()
+            elif len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown:
+                    self._idle += 1
+                    self._cond.wait()
+                    self._idle -= 1
+                if not self._queue:
+                    return
+                _, _, future, fn, args, kwargs = heapq.heappop(self._queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        """
+        Stops the workers once the queue is empty.
+
+        :param wait: Wait for the running tasks to finish
+        :param cancel_futures: Cancel the tasks that have not started, rather than running them first
+        """
+
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for _, _, future, _, _, _ in self._queue:
+                    future.cancel()
+                self._queue.clear()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+class FameStats:
+    """
+    What a run of the engine did.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.done = 0
+        self.populated = 0
+        self.errors = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.hedges = 0
+        self.cancelled = False
+
+
+METRICS = {
+    "pageviews": wiki.Wikifame.fill_pageviews,
+    "desc": wiki.Wikifame.fill_description,
+    "sitelinks": wiki.Wikifame.fill_sitelinks,
+}
+"""
+The fills the engine can run for each note once its article is known
+"""
+
+
+class FameEngine:
+    """
+    Fills the article, article fixed, description, pageviews and/or sitelinks fields of notes.
+    """
+
+    def __init__(
+        self,
+        mw: 'AnkiQt',
+        nids: Sequence['NoteId'],
+        phrase_for: Callable[[Dict[str, str]], str],
+        field_name: str,
+        project: str = "en.wikipedia.org",
+        connections: int = 100,
+        rate: int = 100,
+        per: float = 1,
+        timeout: float = 5,
+        window: Optional[int] = None,
+        metrics: Sequence[str] = ("pageviews", "desc"),
+        on_written: Optional[Callable[[wiki.Wikifame], None]] = None,
+        hedge_budget: float = 0,
+        reuse_articles: bool = False,
+        ) -> None:
+        """
+        :param mw: The main window
+        :param nids: The notes to fill
+        :param phrase_for: Returns the search phrase for a note, given its fields ({name: value})
+        :param field_name: The name of the pageviews field.  The other fields are named after it, e.g. "<name> (URL)".
+        :param project: The Wikimedia project to get pageviews from
+        :param connections: How many requests may be in flight at once
+        :param rate: How many requests may be sent every per seconds
+        :param per: See rate
+        :param timeout: How many seconds to wait for each response
+        :param window: How many notes may be in flight (fetched but not yet written) at once.  Defaults to 2 * connections.
+        :param metrics: Which of METRICS to fill after the search.  A note counts as populated if the first succeeded.
+        :param on_written: Called on the main thread with each Wikifame once its note has been written (or found to be
+            up to date), e.g. to record when its fame was fetched
+        :param hedge_budget: If above 0, requests slower than the recent p95 are sent again (see net.Hedger), up to
+            this fraction of all requests, so a slow backend does not stall the end of the run
+        :param reuse_articles: If True, notes whose article fixed field already holds an article (e.g. found by an
+            earlier run over the same notes) are not searched again
+        """
+
+        self.mw = mw
+        self.nids = nids
+        self.phrase_for = phrase_for
+        self.field_names = wiki.FieldNames.named_after(field_name)
+        self.project = project
+        self.connections = connections
+        self.limiter = net.RateLimiter(rate, per)
+        self.timeout = timeout
+        self.window = window if window is not None else 2 * connections
+        self.metrics = list(metrics)
+        self.on_written = on_written
+        self.hedge_budget = hedge_budget
+        self.reuse_articles = reuse_articles
+
+    def _wikifames(self) -> Iterator[wiki.Wikifame]:
+        for nid, fields in scoring.iter_fields(self.mw.col, self.nids):
+            current = {name: fields.get(name) for _, name in self.field_names.items() if name is not None}
+            article = None
+            if self.reuse_articles:
+                article = current.get(self.field_names.article_fixed) or None
+                if article is not None and article.startswith("ERROR"):
+                    article = None
+            yield wiki.Wikifame(self.mw, nid, search_phrase=self.phrase_for(fields), article=article,
+                project=self.project, field_names=self.field_names, current=current)
+
+    def run(self, on_progress: Optional[Callable[[FameStats], bool]] = None) -> FameStats:
+        """
+        Runs the engine to completion (or cancellation).  Must be called on the main thread, which writes the notes;
+        the fetching happens on worker threads.
+
+        :param on_progress: Called on the main thread after each batch of notes is written.  Return True to cancel.
+        :return: What the run did
+        """
+
+        stats = FameStats(len(self.nids))
+        wikifames = enumerate(self._wikifames())
+        pending: Dict[concurrent.futures.Future, Tuple[str, int, wiki.Wikifame]] = {}
+        remaining: Dict[int, int] = {}
+        in_flight = 0
+
+        hedger = net.Hedger(budget=self.hedge_budget) if self.hedge_budget > 0 else None
+        old_limiter, old_hedger = wiki.limiter, wiki.hedger
+        old_flights = wiki.search_flight, wiki.article_flight
+        wiki.limiter = self.limiter
+        wiki.hedger = hedger
+        # Share only the calls in flight: keeping every result would hold a future per note until the run ends
+        wiki.search_flight = wiki.SingleFlight(keep=False)
+        wiki.article_flight = wiki.SingleFlight(keep=False)
+        executor = PriorityExecutor(max_workers=self.connections)
+        try:
+            while True:
+                # Backpressure: only admit new notes while the window has room
+                for priority, wf in itertools.islice(wikifames, self.window - in_flight):
+                    in_flight += 1
+                    if wf.article is not None:
+                        # Its article is already known, so it goes straight to its fills
+                        future = concurrent.futures.Future()
+                        future.set_result(wf)
+                    else:
+                        future = executor.submit(priority, wf.search_up_article, timeout=self.timeout)
+                    pending[future] = ("search", priority, wf)
+                if not pending:
+                    break
+
+                done, _ = concurrent.futures.wait(pending, timeout=0.05, return_when=concurrent.futures.FIRST_COMPLETED)
+                finished = []
+                for future in done:
+                    stage, priority, wf = pending.pop(future)
+                    failed = future.exception() is not None
+                    if stage == "search":
+                        if failed:
+                            stats.errors += 1
+                            finished.append(wf)
+                        else:
+                            remaining[id(wf)] = len(self.metrics)
+                            for metric in self.metrics:
+                                future = executor.submit(priority, METRICS[metric], wf, timeout=self.timeout)
+                                pending[future] = (metric, priority, wf)
+                            if not self.metrics:
+                                del remaining[id(wf)]
+                                finished.append(wf)
+                        continue
+                    if stage == self.metrics[0]:
+                        if failed:
+                            stats.errors += 1
+                        else:
+                            stats.populated += 1
+                    remaining[id(wf)] -= 1
+                    if remaining[id(wf)] == 0:
+                        del remaining[id(wf)]
+                        finished.append(wf)
+
+                changed_notes = []
+                for wf in finished:
+                    if wf.write(changed_notes):
+                        stats.changed += 1
+                    else:
+                        stats.unchanged += 1
+                    if self.on_written is not None:
+                        self.on_written(wf)
+                    in_flight -= 1
+                    stats.done += 1
+                if changed_notes:
+                    self.mw.col.update_notes(changed_notes)
+                if on_progress is not None and on_progress(stats):
+                    stats.cancelled = True
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            wiki.limiter, wiki.hedger = old_limiter, old_hedger
+            wiki.search_flight, wiki.article_flight = old_flights
+            if hedger is not None:
+                hedger.close()
+                stats.hedges = hedger.hedges
+        return stats
@@ -0,0 +1,214 @@
+"""
+"Fame packs": portable files of precomputed fame data, so that teams can share it and fill fields without fetching.
+
+A fame pack holds three sortedtables, each memory-mapped and looked up in O(log n):
+
+ • phrase -> article (search phrases keyed by titleindex.title_key)
+ • article -> pageviews (an int64; articles keyed by titleindex.article_key)
+ • article -> description
+
+    MAGIC | phrases table offset | pageviews table offset | descriptions table offset (uint64s)
+          | start date | end date (8 bytes each, YYYYMMDD) | project (64 bytes, NUL-padded) | the tables
+
+The pageviews are totals for the pack's project from its start to its end date, so they are only used for requests
+over the same range (see FamePack.covers).  Packs written before the range was stored (OAKFAME1) have none: their
+phrases and descriptions are still used, their pageviews never are.
+
+Write one with write_pack (or from notes, with FamePackWriter), and read it with FamePack:
+
+    pack = FamePack("presidents.fame")
+    pack.lookup("George Washington")  # ("George_Washington", 41234567, "First president of the United States")
+"""
+
+import mmap
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from . import sortedtable, titleindex
+except ImportError: # Running this module by itself for dev purposes
+    import sortedtable, titleindex
+
+MAGIC = b"OAKFAME2"
+_header = struct.Struct("<8sQQQ8s8s64s")
+_OLD_MAGIC = b"OAKFAME1"
+_old_header = struct.Struct("<8sQQQ")
+_pageviews = struct.Struct("<q")
+
+
+def _encode(items: Iterable[Tuple[str, bytes]]) -> List[Tuple[bytes, bytes]]:
+    return sorted((key.encode("utf-8"), value) for key, value in items)
+
+
+def write_pack(
+    path: str,
+    phrases: Dict[str, str],
+    pageviews: Dict[str, int],
+    descs: Dict[str, str],
+    project: str = "en.wikipedia.org",
+    start: str = "20150701",
+    end: str = "20230101",
+    ) -> None:
+    """
+    Writes a fame pack.
+
+    :param path: Where to write the fame pack
+    :param phrases: A map from search phrase to article title (as a URL string)
+    :param pageviews: A map from article title to pageviews
+    :param descs: A map from article title to short description
+    :param project: The Wikimedia project the pageviews are from
+    :param start: The first day the pageviews count (YYYYMMDD)
+    :param end: The last day the pageviews count (YYYYMMDD)
+    """
+
+    phrase_rows = {titleindex.title_key(p): a.encode("utf-8") for p, a in phrases.items()}
+    pageview_rows = {titleindex.article_key(a): _pageviews.pack(v) for a, v in pageviews.items()}
+    desc_rows = {titleindex.article_key(a): d.encode("utf-8") for a, d in descs.items()}
+    tables = [_encode(rows.items()) for rows in (phrase_rows, pageview_rows, desc_rows)]
+    with open(path, "wb") as f:
+        f.write(b"\0" * _header.size)
+        positions = []
+        for table in tables:
+            positions.append(f.tell())
+            sortedtable.write_table(f, table)
+        f.seek(0)
+        f.write(_header.pack(MAGIC, *positions, start.encode("ascii"), end.encode("ascii"), project.encode("utf-8")))
+
+
+class FamePackWriter:
+    """
+    Collects fame data (e.g. as notes are filled) and writes it as a fame pack.  Later values win.
+    """
+
+    def __init__(self, project: str = "en.wikipedia.org", start: str = "20150701", end: str = "20230101") -> None:
+        """
+        :param project: The Wikimedia project the added pageviews are from
+        :param start: The first day the added pageviews count (YYYYMMDD)
+        :param end: The last day the added pageviews count (YYYYMMDD)
+        """
+
+        self.project = project
+        self.start = start
+        self.end = end
+        self.phrases: Dict[str, str] = {}
+        self.pageviews: Dict[str, int] = {}
+        self.descs: Dict[str, str] = {}
+
+    def add(
+        self,
+        search_phrase: Optional[str],
+        article: Optional[str],
+        pageviews: Optional[int] = None,
+        desc: Optional[str] = None,
+        ) -> None:
+        """
+        Adds what is known about one search phrase.  Missing (None) values are skipped, as are errors.
+
+        :param search_phrase: The search phrase
+        :param article: The article it resolved to, as a URL string
+        :param pageviews: The article's pageviews
+        :param desc: The article's short description
+        """
+
+        if not article or article.startswith("ERROR"):
+            return
+        if search_phrase:
+            self.phrases[search_phrase] = article
+        if isinstance(pageviews, int):
+            self.pageviews[article] = pageviews
+        if desc is not None and not desc.startswith("ERROR"):
+            self.descs[article] = desc
+
+    def update(self, pack: 'FamePack') -> None:
+        """
+        Adds everything in an existing fame pack (without overriding what was already added).  Its pageviews are only
+        added if they cover the same project and dates as this writer's.
+        """
+
+        for key, value in pack.phrases_table.items():
+            self.phrases.setdefault(key.decode("utf-8"), value.decode("utf-8"))
+        if pack.covers(self.project, self.start, self.end):
+            for key, value in pack.pageviews_table.items():
+                self.pageviews.setdefault(key.decode("utf-8"), _pageviews.unpack(value)[0])
+        for key, value in pack.descs_table.items():
+            self.descs.setdefault(key.decode("utf-8"), value.decode("utf-8"))
+
+    def write(self, path: str) -> None:
+        write_pack(path, self.phrases, self.pageviews, self.descs, self.project, self.start, self.end)
+
+
+class FamePack:
+    """
+    A memory-mapped, read-only fame pack.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: The path to a fame pack written by write_pack
+        """
+
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.project: Optional[str] = None
+        self.start: Optional[str] = None
+        self.end: Optional[str] = None
+        magic = self._mm[:len(MAGIC)]
+        if magic == MAGIC:
+            _, phrases_pos, pageviews_pos, descs_pos, start, end, project = _header.unpack_from(self._mm, 0)
+            self.start, self.end = start.decode("ascii"), end.decode("ascii")
+            self.project = project.rstrip(b"\0").decode("utf-8")
+        elif magic == _OLD_MAGIC:
+            _, phrases_pos, pageviews_pos, descs_pos = _old_header.unpack_from(self._mm, 0)
+        else:
+            self.close()
+            raise ValueError("{} is not a fame pack".format(path))
+        self.phrases_table = sortedtable.Table(self._mm, phrases_pos)
+        self.pageviews_table = sortedtable.Table(self._mm, pageviews_pos)
+        self.descs_table = sortedtable.Table(self._mm, descs_pos)
+
+    def covers(self, project: str, start: str, end: str) -> bool:
+        """
+        Returns whether the pack's pageviews are for project from start to end (YYYYMMDD), i.e. whether they can stand
+        in for a request over that range.
+        """
+
+        return (self.project, self.start, self.end) == (project, start, end)
+
+    def article(self, search_phrase: str) -> Optional[str]:
+        """
+        Returns the article (as a URL string) that search_phrase resolved to, or None if it is not in the pack.
+        """
+
+        article = self.phrases_table.get(titleindex.title_key(search_phrase).encode("utf-8"))
+        return None if article is None else article.decode("utf-8")
+
+    def pageviews(self, article: str) -> Optional[int]:
+        """
+        Returns the pageviews of article (from the pack's start to its end date), or None if it is not in the pack.
+        """
+
+        value = self.pageviews_table.get(titleindex.article_key(article).encode("utf-8"))
+        return None if value is None else _pageviews.unpack(value)[0]
+
+    def desc(self, article: str) -> Optional[str]:
+        """
+        Returns the short description of article, or None if it is not in the pack.
+        """
+
+        value = self.descs_table.get(titleindex.article_key(article).encode("utf-8"))
+        return None if value is None else value.decode("utf-8")
+
+    def lookup(self, search_phrase: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+        """
+        Returns (article, pageviews, description) for a search phrase, with None for anything not in the pack.
+        """
+
+        article = self.article(search_phrase)
+        if article is None:
+            return None, None, None
+        return article, self.pageviews(article), self.desc(article)
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
@@ -0,0 +1,198 @@
+"""
+A local fuzzy search over Wikipedia titles, approximating opensearch closely enough to resolve most search phrases
+offline.  It copes with typos, missing diacritics and "Surname, Firstname" ordering.
+
+Titles are indexed by character trigrams and scored with BM25.  The best candidates are then re-ranked by string
+similarity and, when pageview data is available, by popularity:
+
+    index = FuzzyIndex(titleindex.TitleIndex("titles.idx").titles(), popularity={"Apple": 1234567})
+    index.search("Beyonce")  # [("Beyoncé", 1.0), ("Beyoncé_Knowles_discography", 0.43), ...]
+"""
+
+from array import array
+from difflib import SequenceMatcher
+import heapq
+import math
+import pickle
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_non_word_re = re.compile(r"[\W_]+")
+_surname_re = re.compile(r"^\s*([^,]+?)\s*,\s*([^,]+?)\s*$")
+
+
+def fold(text: str) -> str:
+    """
+    Folds text for fuzzy matching: strips diacritics, case-folds, and turns underscores and punctuation into spaces.
+
+    :param text: A title or search phrase
+    :return: The folded text, e.g. "Beyoncé_Knowles" -> "beyonce knowles"
+    """
+
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _non_word_re.sub(" ", text.casefold()).strip()
+
+
+def trigrams(folded: str) -> List[str]:
+    """
+    Returns the distinct character trigrams of some folded text, padded so that word boundaries count.
+
+    :param folded: Text folded by fold
+    :return: The distinct trigrams
+    """
+
+    padded = " " + folded + " "
+    return list(dict.fromkeys(padded[i:i+3] for i in range(len(padded) - 2)))
+
+
+def query_variants(phrase: str) -> List[str]:
+    """
+    Returns the folded forms of a search phrase worth trying, e.g. "Lincoln, Abraham" also tries "abraham lincoln".
+
+    :param phrase: The search phrase
+    :return: The folded variants, most likely first
+    """
+
+    variants = [fold(phrase)]
+    match = _surname_re.match(phrase)
+    if match:
+        variants.insert(0, fold(match.group(2) + " " + match.group(1)))
+    return [v for v in dict.fromkeys(variants) if v]
+
+
+class FuzzyIndex:
+    """
+    A trigram/BM25 index over article titles.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    rerank = 50
+    """
+    How many BM25 candidates are re-ranked by string similarity and popularity
+    """
+
+    def __init__(
+        self,
+        titles: Iterable[str],
+        popularity: Optional[Dict[str, int]] = None,
+        popularity_weight: float = 0.15,
+        ) -> None:
+        """
+        :param titles: The article titles (with spaces or underscores)
+        :param popularity: An optional map from title (with underscores) to pageviews, used as a prior
+        :param popularity_weight: How much the popularity prior can add to a candidate's score (0 to 1)
+        """
+
+        self.titles: List[str] = []
+        self.lengths = array("H")
+        postings: Dict[str, array] = {}
+        for title in titles:
+            title = title.replace(" ", "_")
+            grams = trigrams(fold(title))
+            doc = len(self.titles)
+            self.titles.append(title)
+            self.lengths.append(min(len(grams), 65535))
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("I")
+                posting.append(doc)
+        self.postings = postings
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 1.0
+        self.popularity: Dict[str, int] = {}
+        self.popularity_weight = popularity_weight
+        self._max_log_pop = 1.0
+        if popularity:
+            self.set_popularity(popularity)
+
+    def set_popularity(self, popularity: Dict[str, int]) -> None:
+        """
+        Sets the popularity prior, e.g. from pageview data.
+
+        :param popularity: A map from title (with underscores) to pageviews
+        """
+
+        self.popularity = popularity
+        self._max_log_pop = max((math.log1p(max(p, 0)) for p in popularity.values()), default=0.0) or 1.0
+
+    def _bm25(self, folded: str) -> Dict[int, float]:
+        n = len(self.titles)
+        scores: Dict[int, float] = {}
+        grams = [g for g in trigrams(folded) if g in self.postings]
+        # Rare grams first; very common grams only add to candidates that rarer grams already found
+        grams.sort(key=lambda g: len(self.postings[g]))
+        for i, gram in enumerate(grams):
+            posting = self.postings[gram]
+            df = len(posting)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            common = i > 0 and df > n // 10
+            for doc in posting:
+                if common and doc not in scores:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * (self.k1 + 1) / (1 + norm)
+        return scores
+
+    def search(self, phrase: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Returns the top k titles for a search phrase, best first.
+
+        :param phrase: The search phrase
+        :param k: How many candidates to return
+        :return: A list of (title with underscores, score) pairs.  Scores are 0 to 1, with 1 an exact match
+            (ignoring case, punctuation and diacritics) of the most popular title.
+        """
+
+        best: Dict[int, float] = {}
+        for folded in query_variants(phrase):
+            scores = self._bm25(folded)
+            if not scores:
+                continue
+            top_bm25 = max(scores.values())
+            for doc, bm25 in heapq.nlargest(self.rerank, scores.items(), key=lambda item: item[1]):
+                title = self.titles[doc]
+                similarity = SequenceMatcher(None, folded, fold(title), autojunk=False).ratio()
+                score = 0.85 * similarity + 0.15 * bm25 / top_bm25
+                if self.popularity:
+                    prior = math.log1p(max(self.popularity.get(title, 0), 0)) / self._max_log_pop
+                    score = (1 - self.popularity_weight) * score + self.popularity_weight * prior
+                best[doc] = max(best.get(doc, 0.0), score)
+        ranked = heapq.nlargest(k, best.items(), key=lambda item: item[1])
+        return [(self.titles[doc], score) for doc, score in ranked]
+
+    def best_title(self, phrase: str, min_score: float = 0.6) -> Optional[str]:
+        """
+        Returns the best title for a search phrase, or None if nothing scores at least min_score.
+
+        :param phrase: The search phrase
+        :param min_score: The lowest acceptable score
+        :return: The title (with underscores), or None
+        """
+
+        results = self.search(phrase, k=1)
+        if results and results[0][1] >= min_score:
+            return results[0][0]
+        return None
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index, so it need not be rebuilt from the title list next time.
+        """
+
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> 'FuzzyIndex':
+        """
+        Loads an index saved with save.
+        """
+
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def __len__(self) -> int:
+        return len(self.titles)
@@ -0,0 +1,260 @@
+"""
+Google hit counts ("About 1,230,000 results") for search phrases.
+
+Two providers share the same rate limiting, caching and concurrency:
+
+ • HttpHitCounter fetches the results page with a plain HTTP GET and parses the result-stats element.  It is light,
+   but Google may serve consent or captcha pages instead.
+ • BrowserHitCounter keeps a pool of warm headless Firefox browsers (needs selenium and geckodriver) and reads the
+   rendered result-stats element, as order.py used to do with a single browser.
+
+Both take a base_url, so they can be pointed at a local stand-in that serves result-stats pages, and a cassette, to
+record the hit counts they found and replay them later with no network.
+"""
+
+import concurrent.futures
+import json
+import queue
+import re
+import threading
+from html import unescape
+from typing import Callable, List, Optional, Sequence
+from urllib import parse
+
+try:
+    from . import cassette, net
+except ImportError: # Running this module by itself for dev purposes
+    import cassette, net
+
+GOOGLE = "https://www.google.com"
+
+_stats_re = re.compile(r'<div[^>]*id="result-stats"[^>]*>(.*?)</div>', re.S)
+_tags_re = re.compile(r"<[^>]+>")
+_count_re = re.compile(r"([\d][\d,.\s]*)\s+results?\b")
+
+
+def parse_hits(text: str) -> Optional[int]:
+    """
+    Parses the hit count from the text of a result-stats element, e.g. "About 1,230,000 results (0.41 seconds)".
+
+    :param text: The text of the result-stats element
+    :return: The number of hits, or None if the text has no hit count
+    """
+
+    match = _count_re.search(text)
+    if match is None:
+        return None
+    digits = re.sub(r"\D", "", match.group(1))
+    return int(digits) if digits else None
+
+
+def parse_hits_html(html: str) -> Optional[int]:
+    """
+    Parses the hit count from a whole results page.
+
+    :param html: The HTML of the results page
+    :return: The number of hits, or None if the page has no result-stats element
+    """
+
+    match = _stats_re.search(html)
+    if match is None:
+        return None
+    return parse_hits(unescape(_tags_re.sub("", match.group(1))))
+
+
+class HitCounter:
+    """
+    The base class of the hit count providers.  Subclasses implement _fetch.
+    """
+
+    def __init__(
+        self,
+        base_url: str = GOOGLE,
+        workers: int = 4,
+        limiter: Optional[net.RateLimiter] = None,
+        cache: Optional[net.Cache] = None,
+        timeout: float = 10,
+        tape: Optional[cassette.Cassette] = None,
+        ) -> None:
+        """
+        :param base_url: Where to search, e.g. "https://www.google.com" or a local stand-in like "http://127.0.0.1:8000"
+        :param workers: How many searches may run at once
+        :param limiter: Limits how often searches are sent.  Defaults to 1 per second.
+        :param cache: Where hit counts are cached, keyed by search URL.  Defaults to an in-memory cache.
+        :param timeout: How many seconds to wait for a page before giving up
+        :param tape: An optional cassette to record hit counts to, or replay them from, keyed by search URL
+        """
+
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.limiter = limiter if limiter is not None else net.RateLimiter(1, 1)
+        self.cache = cache if cache is not None else net.Cache()
+        self.timeout = timeout
+        self.tape = tape
+
+    def search_url(self, search_phrase: str) -> str:
+        return self.base_url + "/search?q=" + parse.quote_plus(search_phrase)
+
+    def _fetch(self, url: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def count(self, search_phrase: str) -> Optional[int]:
+        """
+        Returns the number of hits for a search phrase, or None if the page had no hit count.
+
+        :param search_phrase: The search phrase
+        :return: The number of hits
+        """
+
+        url = self.search_url(search_phrase)
+        hits = self.cache.get(url)
+        if hits is None:
+            if self.tape is None or not self.tape.replaying:
+                self.limiter.acquire()
+            if self.tape is None:
+                hits = self._fetch(url)
+            else:
+                hits = json.loads(self.tape.fetch(url, lambda: (200, json.dumps(self._fetch(url)).encode("utf-8")))[1])
+            if hits is not None:
+                self.cache.put(url, hits)
+        return hits
+
+    def count_many(
+        self,
+        search_phrases: Sequence[str],
+        on_done: Optional[Callable[[int, Optional[int]], None]] = None,
+        ) -> List[Optional[int]]:
+        """
+        Returns the number of hits for each search phrase, searching up to workers of them at once.
+        Pages that fail to load count as None.
+
+        :param search_phrases: The search phrases
+        :param on_done: Called with (index, hits) as each search finishes, e.g. to update a progress bar.  If it
+            returns True, the remaining searches are cancelled (and count as None).
+        :return: The number of hits for each search phrase, in order
+        """
+
+        results: List[Optional[int]] = [None] * len(search_phrases)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.count, sp): i for i, sp in enumerate(search_phrases)}
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception:
+                    results[i] = None
+                if on_done is not None and on_done(i, results[i]):
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+        return results
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> 'HitCounter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class HttpHitCounter(HitCounter):
+    """
+    Counts hits by fetching results pages over plain HTTP.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        import requests
+
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+        self._requests = requests
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+            session.headers.update({"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0"})
+            session.cookies.set("CONSENT", "YES+", domain=parse.urlparse(self.base_url).hostname or "")
+        return session
+
+    def _fetch(self, url: str) -> Optional[int]:
+        resp = self._session().get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return parse_hits_html(resp.text)
+
+
+class BrowserHitCounter(HitCounter):
+    """
+    Counts hits with a pool of warm headless Firefox browsers, one per worker, started on first use.
+    """
+
+    def __init__(self, *args, headless: bool = True, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.headless = headless
+        self._drivers: queue.Queue = queue.Queue()
+        self._all_drivers: List = []
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _new_driver(self):
+        from selenium import webdriver
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.wait import WebDriverWait
+
+        options = webdriver.FirefoxOptions()
+        options.page_load_strategy = "eager"
+        if self.headless:
+            options.add_argument("-headless")
+        driver = webdriver.Firefox(options=options)
+        driver.set_page_load_timeout(self.timeout)
+        driver.get(self.base_url)
+        try:
+            # Google's cookie consent button, if shown
+            WebDriverWait(driver, timeout=3).until(EC.element_to_be_clickable((By.ID, "L2AGLb"))).click()
+        except TimeoutException:
+            pass
+        return driver
+
+    def _borrow(self):
+        with self._lock:
+            start = self._drivers.empty() and self._started < self.workers
+            if start:
+                self._started += 1
+        if start:
+            try:
+                driver = self._new_driver()
+            except Exception:
+                with self._lock:
+                    self._started -= 1
+                raise
+            with self._lock:
+                self._all_drivers.append(driver)
+            return driver
+        return self._drivers.get()
+
+    def _fetch(self, url: str) -> Optional[int]:
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.wait import WebDriverWait
+
+        driver = self._borrow()
+        try:
+            driver.get(url)
+            el = WebDriverWait(driver, poll_frequency=0.02, timeout=self.timeout).until(
+                lambda d: d.find_element(By.ID, "result-stats"))
+            return parse_hits(el.get_attribute("textContent") or el.text)
+        except TimeoutException:
+            return None
+        finally:
+            self._drivers.put(driver)
+
+    def close(self) -> None:
+        with self._lock:
+            drivers, self._all_drivers = self._all_drivers, []
+            self._started = 0
+        self._drivers = queue.Queue()
+        for driver in drivers:
+            driver.quit()
@@ -0,0 +1,308 @@
+"""
+Networking helpers shared by the fame providers: a thread-safe (or process-shared) rate limiter, request hedging and a
+persistent result cache.
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, Optional, Tuple
+
+USER_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_files")
+"""
+The add-on's user_files folder, which Anki keeps when the add-on is updated
+"""
+
+
+class RateLimiter:
+    """
+    Allows at most rate calls to acquire per per seconds, across all threads.
+
+    Like the query loop in the Add Fame dialog, it remembers when each of the last rate calls happened, and a new call
+    waits until the oldest of them is more than per seconds old.
+    """
+
+    def __init__(self, rate: int = 100, per: float = 1) -> None:
+        """
+        :param rate: How many calls are allowed per window
+        :param per: The length of the window, in seconds
+        """
+
+        self.rate = rate
+        self.per = per
+        self._times = [-2 * per] * rate
+        self._no = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until another call is allowed, then claims it.
+        """
+
+        with self._lock:
+            slot = self._no % self.rate
+            self._no += 1
+            wait = self._times[slot] + self.per * 1.01 - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._times[slot] = time.monotonic()
+
+    @property
+    def calls(self) -> int:
+        """
+        How many calls acquire has let through (or is holding back)
+        """
+
+        return self._no
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter shared by processes, e.g. the workers of a process pool: its call times live in shared memory.
+    Make it before starting the processes and hand it to each when it starts (as a Process argument or a pool's
+    initargs); it cannot be sent to a process that is already running.
+    """
+
+    def __init__(self, rate: int = 100, per: float = 1) -> None:
+        """
+        :param rate: How many calls are allowed per window, across all the processes
+        :param per: The length of the window, in seconds
+        """
+
+        import multiprocessing
+
+        self.rate = rate
+        self.per = per
+        self._times = multiprocessing.RawArray("d", [-2 * per] * rate)
+        self._count = multiprocessing.RawValue("q", 0)
+        self._lock = multiprocessing.Lock()
+
+    @property
+    def _no(self) -> int:
+        return self._count.value
+
+    @_no.setter
+    def _no(self, value: int) -> None:
+        self._count.value = value
+
+
+class Hedger:
+    """
+    Hedges slow calls: if a call has not returned by the recent p95 latency, one duplicate is sent, and whichever
+    returns first wins.  The extra calls are capped at budget (e.g. 5%) of all calls, so a slow backend cannot make the
+    hedges pile on.
+
+    Calls run on the hedger's own threads, so the caller can return as soon as either copy does.  The loser is cancelled
+    if it has not started; otherwise it is left to finish and its result is dropped.  Latencies are tracked per key
+    (e.g. per host), since a search and a pageviews call have different tails.
+    """
+
+    def __init__(
+        self,
+        budget: float = 0.05,
+        percentile: float = 0.95,
+        window: int = 200,
+        min_samples: int = 20,
+        max_workers: int = 256,
+        ) -> None:
+        """
+        :param budget: The most hedges to send, as a fraction of all calls
+        :param percentile: Hedge calls slower than this percentile of recent latencies
+        :param window: How many recent latencies to track per key
+        :param min_samples: How many latencies a key needs before its calls are hedged
+        :param max_workers: How many calls (including hedges) may run at once
+        """
+
+        self.budget = budget
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._latencies: Dict[Hashable, Deque[float]] = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def delay(self, key: Hashable = None) -> Optional[float]:
+        """
+        Returns how long a call for key may take before it is hedged, or None if too few calls have been timed.
+        """
+
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(int(len(latencies) * self.percentile), len(latencies) - 1)]
+
+    def _record(self, key: Hashable, latency: float) -> None:
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = collections.deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def _claim_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def call(self, fn: Callable[[], Any], key: Hashable = None) -> Any:
+        """
+        Returns fn(), hedged if it is slow.  If the first copy to return raised, waits for the other.
+
+        :param fn: The call, e.g. an HTTP GET.  It must be safe to run twice.
+        :param key: What the call's latency is tracked under, e.g. the host
+        :return: What fn returned
+        """
+
+        with self._lock:
+            self.calls += 1
+        delay = self.delay(key)
+        start = time.monotonic()
+        primary = self._executor.submit(fn)
+        if delay is None or concurrent.futures.wait([primary], timeout=delay).done or not self._claim_hedge():
+            result = primary.result()
+            self._record(key, time.monotonic() - start)
+            return result
+
+        hedge = self._executor.submit(fn)
+        pending = {primary, hedge}
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            # Prefer a copy that succeeded; if both failed, the last one's error is raised
+            winner = min(done, key=lambda future: future.exception() is not None)
+            if winner.exception() is None or not pending:
+                break
+        for future in pending:
+            future.cancel()
+        if winner is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        # When the hedge wins, the primary's latency is at least this long, which is what the tail needs to know
+        self._record(key, time.monotonic() - start)
+        return winner.result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class Cache:
+    """
+    A thread-safe key-value cache of JSON-serialisable results, kept in an SQLite file (or in memory).
+
+    An entry can also keep the HTTP validators (ETag and Last-Modified) of the response it came from, so that once it
+    is too old it can be revalidated with a conditional request instead of downloaded again (see entry and touch).
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        """
+        :param path: The path to the cache file, created if needed.  ":memory:" keeps the cache for this run only.
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._con:
+            self._con.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, fetched_at REAL, "
+                "etag TEXT, last_modified TEXT)")
+            # Caches made before validators were kept
+            columns = [row[1] for row in self._con.execute("PRAGMA table_info(cache)")]
+            for column in ("etag", "last_modified"):
+                if column not in columns:
+                    self._con.execute("ALTER TABLE cache ADD COLUMN {} TEXT".format(column))
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """
+        Returns the cached value for key, or None if there is none (or it is older than max_age seconds).
+
+        :param key: The key, e.g. a URL
+        :param max_age: The oldest acceptable entry, in seconds.  None accepts any age.
+        """
+
+        with self._lock:
+            row = self._con.execute("SELECT value, fetched_at FROM cache WHERE key=?", (key,)).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return json.loads(row[0])
+
+    def entry(self, key: str) -> Optional[Tuple[Any, float, Optional[str], Optional[str]]]:
+        """
+        Returns the cached entry for key whatever its age, or None if there is none.
+
+        :param key: The key, e.g. a URL
+        :return: (value, fetched_at, etag, last_modified)
+        """
+
+        with self._lock:
+            row = self._con.execute("SELECT value, fetched_at, etag, last_modified FROM cache WHERE key=?",
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2], row[3]
+
+    def put(self, key: str, value: Any, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """
+        Caches value under key, replacing any older entry.
+
+        :param key: The key, e.g. a URL
+        :param value: A JSON-serialisable value
+        :param etag: The ETag header of the response value came from, if any
+        :param last_modified: The Last-Modified header of the response value came from, if any
+        """
+
+        with self._lock, self._con:
+            self._con.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), time.time(), etag, last_modified))
+
+    def touch(self, key: str) -> None:
+        """
+        Marks the entry for key as fetched now, e.g. when the server has said (with a 304) that it has not changed.
+        """
+
+        with self._lock, self._con:
+            self._con.execute("UPDATE cache SET fetched_at=? WHERE key=?", (time.time(), key))
+
+    def put_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Caches many (key, value) pairs in one transaction, which is much faster than many puts.
+        """
+
+        now = time.time()
+        rows = [(key, json.dumps(value), now) for key, value in items]
+        with self._lock, self._con:
+            self._con.executemany("INSERT OR REPLACE INTO cache (key, value, fetched_at) VALUES (?, ?, ?)", rows)
+
+    def fetched_at(self, key: str) -> Optional[float]:
+        """
+        Returns when key was cached (as a Unix time), or None if it is not cached.
+        """
+
+        with self._lock:
+            row = self._con.execute("SELECT fetched_at FROM cache WHERE key=?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._con.close()
+
+
+def user_cache(name: str = "cache.sqlite") -> Cache:
+    """
+    Opens (creating if needed) a cache file kept in the add-on's user_files folder.
+
+    :param name: The name of the cache file
+    """
+
+    os.makedirs(USER_FILES, exist_ok=True)
+    return Cache(os.path.join(USER_FILES, name))
@@ -0,0 +1,144 @@
+"""
+The Order Notes by... dialog: ranks the selected notes by their fame fields and moves their new cards into that order.
+
+The fame fields of all selected notes are read with one query, ranked with scoring.rank, and the new cards are given
+their new positions with a single update_cards call inside one undoable operation that runs in the background.
+"""
+
+from aqt import AnkiQt
+from aqt.operations import CollectionOp
+from aqt.qt import *
+from aqt.utils import tooltip
+from anki.collection import Collection, OpChanges
+from anki.consts import CARD_TYPE_NEW
+from anki.notes import NoteId
+from anki.utils import ids2str
+
+import re
+from typing import Dict, List, Sequence, Tuple
+
+from . import scoring
+
+UNDO_LABEL = "Order Notes by Fame"
+FAME_FIELD_RE = re.compile(r"(pageviews|hits|sitelinks)$", re.IGNORECASE)
+"""
+Fields whose names match are ticked by default, e.g. "Wiki Pageviews" and "Google Hits"
+"""
+
+
+def reposition(col: Collection, rankedNids: Sequence[NoteId]) -> OpChanges:
+    """
+    Moves the new cards of the notes into the given order, all with one update, as one undo step.  The notes swap the
+    positions they already held (each note's earliest), handed out in rank order, so new cards of other notes keep
+    their places even if they sit between the selected ones.  Cards of the same note share a position (as Anki does).
+
+    :param col: The collection
+    :param rankedNids: The notes, most famous first
+    :return: The changes, for the browser to refresh
+    """
+
+    cardsOfNote: Dict[NoteId, List[Tuple[int, int]]] = {}
+    for cid, nid, due in col.db.execute("select id, nid, due from cards where type = ? and nid in " + ids2str(rankedNids), CARD_TYPE_NEW):
+        cardsOfNote.setdefault(nid, []).append((cid, due))
+
+    slots = sorted(min(due for _, due in cards) for cards in cardsOfNote.values())
+    ranked = [nid for nid in dict.fromkeys(rankedNids) if nid in cardsOfNote]
+    newDue = {cid: slot for nid, slot in zip(ranked, slots) for cid, due in cardsOfNote[nid] if due != slot}
+
+    # Only the cards that move are loaded, all before the one update
+    cards = [col.get_card(cid) for cid in newDue]
+    for card in cards:
+        card.due = newDue[card.id]
+    undoPos = col.add_custom_undo_entry(UNDO_LABEL)
+    col.update_cards(cards)
+    return col.merge_undo_entries(undoPos)
+
+
+class OrderNotesDialog(QDialog):
+    """
+    The class for the Order Notes by... dialog.
+    """
+
+    def __init__(self, browser: QMainWindow, nids: Sequence[NoteId]) -> None:
+        """
+        Initialise the pop-up window for Ordering Notes.
+
+        :param browser: A QMainWindow object for the browser
+        :param nids: A Sequence[NoteId] object of the notes to order
+        """
+
+        QDialog.__init__(self, parent=browser)
+        self.browser: QMainWindow = browser
+        self.nids = nids
+        self.bmw: AnkiQt = self.browser.mw
+        col = self.bmw.col
+        self.fields: List[str] = []
+        for mid in col.db.list("select distinct mid from notes where id in " + ids2str(nids)):
+            for name in col.models.field_names(col.models.get(mid)):
+                if name not in self.fields:
+                    self.fields.append(name)
+        self._setupUi()
+
+    def accept(self) -> None:
+        """
+        When the OK button in the Dialog is clicked, rank the notes and reposition their new cards.
+        """
+
+        weights = {name: spin.value() for name, spin in self.weights.items() if spin.value() != 0}
+        if not weights:
+            tooltip("Give at least one field a weight.", parent=self)
+            return
+        missing = "renormalize" if self.missingSelect.currentIndex() == 1 else "zero"
+        nids = list(self.nids)
+
+        def op(col: Collection) -> OpChanges:
+            columns = scoring.read_columns(col, nids, list(weights))
+            order = scoring.rank(columns, weights, missing=missing)
+            return reposition(col, [nids[i] for i in order])
+
+        def on_done(changes: OpChanges) -> None:
+            tooltip("Ordered {} notes by fame.".format(len(nids)), parent=self.browser)
+
+        CollectionOp(parent=self.browser, op=op).success(on_done).run_in_background()
+        QDialog.accept(self)
+
+    def _setupUi(self) -> None:
+        """
+        Sets up the UI for the Order Notes by... dialog.
+        """
+
+        main_vbox = QVBoxLayout()
+        desc = QLabel("Order the new cards of the selected notes by fame, most famous first.  Each field's values are "
+                      "scaled to 0..1 and weighted; a negative weight puts smaller values first.")
+        desc.setWordWrap(True)
+        main_vbox.addWidget(desc)
+        main_vbox.addWidget(QLabel("<b>Notes selected:</b> " + str(len(self.nids))))
+
+        form = QFormLayout()
+        self.weights: Dict[str, QDoubleSpinBox] = {}
+        for name in self.fields:
+            spin = QDoubleSpinBox()
+            spin.setRange(-10, 10)
+            spin.setSingleStep(0.5)
+            spin.setValue(1 if FAME_FIELD_RE.search(name.strip()) else 0)
+            self.weights[name] = spin
+            form.addRow(QLabel(name), spin)
+        fieldBox = QGroupBox("Weight of each field")
+        fieldBox.setLayout(form)
+        main_vbox.addWidget(fieldBox)
+
+        self.missingSelect = QComboBox()
+        self.missingSelect.addItems(["Empty or error values count as least famous", "Score notes by their other fields only"])
+        main_vbox.addWidget(self.missingSelect)
+
+        buttonBox = QDialogButtonBox(Qt.Horizontal, self)
+        doneButton = buttonBox.addButton(QDialogButtonBox.StandardButton.Ok)
+        cancelButton = buttonBox.addButton(QDialogButtonBox.StandardButton.Cancel)
+        doneButton.setToolTip("Reorder the new cards...")
+        doneButton.clicked.connect(lambda _: self.accept())
+        cancelButton.clicked.connect(self.reject)
+        main_vbox.addWidget(buttonBox)
+
+        self.setLayout(main_vbox)
+        self.setMinimumWidth(400)
+        self.setWindowTitle("Order Notes by...")
@@ -0,0 +1,97 @@
+"""
+Cleans search phrases merged from note fields before they are searched, so that "Ada&nbsp;Lovelace<br>",
+"{{c1::Ada Lovelace}}" and "Ada  Lovelace" become one phrase (and one request, and one cache entry).
+
+    cleaner = PhraseCleaner()
+    phrases = cleaner.clean_all(raw_phrases)
+    cleaner.merged  # how many distinct raw phrases were merged into others
+
+All the patterns are compiled once, and clean results are memoized by raw phrase, so repeated field values are free.
+"""
+
+import html
+import re
+from typing import Dict, Iterable, List
+
+_cloze_re = re.compile(r"\{\{c\d+::(.*?)(?:::[^}]*?)?\}\}", re.DOTALL)
+_tag_re = re.compile(r"<[^>]*>")
+_whitespace_re = re.compile(r"\s+")
+
+
+def clean_phrase(text: str, strip_cloze: bool = True) -> str:
+    """
+    Returns text without HTML tags, with entities decoded and whitespace folded.
+
+    :param text: A merged search phrase, e.g. from a note's fields
+    :param strip_cloze: Replace cloze deletions ({{c1::answer::hint}}) with their answers
+    :return: The clean search phrase
+    """
+
+    if strip_cloze and "{{" in text:
+        text = _cloze_re.sub(r"\1", text)
+    if "<" in text:
+        # Tags like <br> and <div> separate words, so they become spaces rather than nothing
+        text = _tag_re.sub(" ", text)
+    if "&" in text:
+        text = html.unescape(text)
+    return _whitespace_re.sub(" ", text).strip()
+
+
+class PhraseCleaner:
+    """
+    Cleans many search phrases, remembering the results and counting how many distinct phrases the cleaning merged.
+    """
+
+    def __init__(self, strip_cloze: bool = True) -> None:
+        """
+        :param strip_cloze: See clean_phrase
+        """
+
+        self.strip_cloze = strip_cloze
+        self._clean: Dict[str, str] = {}
+        self._raw_keys: Dict[str, None] = {}
+        self._keys: Dict[str, None] = {}
+
+    def clean(self, text: str) -> str:
+        """
+        Returns clean_phrase(text), from memory if text has been seen before.
+        """
+
+        phrase = self._clean.get(text)
+        if phrase is None:
+            phrase = self._clean[text] = clean_phrase(text, self.strip_cloze)
+            # Keyed like wiki.normalize_phrase, so that only the merges made by cleaning are counted
+            self._raw_keys[_whitespace_re.sub(" ", text).strip().casefold()] = None
+            self._keys[phrase.casefold()] = None
+        return phrase
+
+    def clean_all(self, texts: Iterable[str]) -> List[str]:
+        """
+        Returns the clean phrase of each text, in order.
+        """
+
+        return [self.clean(text) for text in texts]
+
+    @property
+    def distinct_raw(self) -> int:
+        """
+        How many distinct raw phrases (ignoring case and whitespace) have been cleaned
+        """
+
+        return len(self._raw_keys)
+
+    @property
+    def distinct(self) -> int:
+        """
+        How many distinct clean phrases (ignoring case) they became
+        """
+
+        return len(self._keys)
+
+    @property
+    def merged(self) -> int:
+        """
+        How many distinct raw phrases became the same search as another one
+        """
+
+        return self.distinct_raw - self.distinct
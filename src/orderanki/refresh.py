@@ -0,0 +1,214 @@
+"""
+The background refresher: keeps pageview fields from going stale without anyone rerunning Add Fame.
+
+It is opt-in (see config.json) and starts a little after a profile is opened.  It finds the notes of every note type
+with "<name>" and "<name> (URL fixed)" fields (as made by Add Fame) whose pageviews are older than max_age_days, and
+refreshes them oldest first, in small batches, through wiki's cached and rate-limited fetch path.  It stops once the
+session's time or request budget is spent (or an Add Fame run starts); the rest wait for the next session.
+
+The pageviews are fetched over the same dates as Add Fame's, so a refreshed field means the same as a freshly added
+one.  Most refreshes are then a conditional request answered with 304 Not Modified; what changes is the notes whose
+URL fixed field was corrected, and those whose earlier fetch failed.
+
+When each note's pageviews were last fetched is kept in user_files/fame_ages.sqlite (the Add Fame dialog records it
+too), since a note's mtime does not change when its fields were already up to date.  Notes never seen count as oldest.
+
+All of the work (finding notes, fetching and writing) runs on background threads, so the UI never blocks.
+"""
+
+import concurrent.futures
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from . import net, wiki
+
+if TYPE_CHECKING:
+    from anki.collection import Collection
+    from anki.notes import NoteId
+    from aqt import AnkiQt
+
+URL_FIXED_SUFFIX = " (URL fixed)"
+AGES_NAME = "fame_ages.sqlite"
+
+DEFAULT_CONFIG = {
+    "enabled": False,
+    "max_age_days": 30,
+    "start_delay_seconds": 30,
+    "session_seconds": 60,
+    "session_requests": 500,
+    "batch_size": 20,
+    "rate_per_second": 10,
+}
+"""
+The refresher's settings, under "refresh" in config.json
+"""
+
+
+def openAges() -> net.Cache:
+    """
+    Opens the record of when each note's pageviews were last fetched.
+    """
+
+    return net.user_cache(AGES_NAME)
+
+
+def agesKey(nid: 'NoteId', fieldName: str) -> str:
+    return "{}:{}".format(nid, fieldName)
+
+
+def findStale(col: 'Collection', ages: net.Cache, maxAge: float) -> List[Tuple['NoteId', str, str]]:
+    """
+    Finds the notes whose pageviews are older than maxAge seconds (or were never fetched), oldest first.
+
+    :param col: The collection
+    :param ages: The record of when each note's pageviews were fetched
+    :param maxAge: The oldest acceptable pageviews, in seconds
+    :return: (nid, pageviews field name, article) for each stale note
+    """
+
+    now = time.time()
+    stale = []
+    for model in col.models.all():
+        names = [f["name"] for f in model["flds"]]
+        for ordFixed, name in enumerate(names):
+            if not name.endswith(URL_FIXED_SUFFIX) or name[:-len(URL_FIXED_SUFFIX)] not in names:
+                continue
+            fieldName = name[:-len(URL_FIXED_SUFFIX)]
+            for nid, flds in col.db.execute("select id, flds from notes where mid = ?", model["id"]):
+                article = flds.split("\x1f")[ordFixed]
+                if not article or article.startswith("ERROR"):
+                    continue
+                fetchedAt = ages.fetched_at(agesKey(nid, fieldName))
+                if fetchedAt is None or now - fetchedAt > maxAge:
+                    stale.append((fetchedAt or 0, nid, fieldName, article))
+    stale.sort(key=lambda row: row[0])
+    return [(nid, fieldName, article) for _, nid, fieldName, article in stale]
+
+
+class Refresher:
+    """
+    One session of background refreshing, within a time and request budget.
+    """
+
+    def __init__(self, mw: 'AnkiQt', config: Dict[str, Any]) -> None:
+        """
+        :param mw: The main window
+        :param config: The refresher's settings (see DEFAULT_CONFIG)
+        """
+
+        self.mw = mw
+        self.config = dict(DEFAULT_CONFIG, **config)
+        self.ages = openAges()
+        self.cache: Optional[net.Cache] = None
+        self.limiter = net.RateLimiter(self.config["rate_per_second"], 1)
+        self.stale: List[Tuple['NoteId', str, str]] = []
+        self.refreshed = 0
+        self.deadline = 0.0
+
+    @property
+    def requests(self) -> int:
+        """
+        How many requests the session has sent, counting every request but cache hits (each takes a slot of the rate
+        limiter)
+        """
+
+        return self.limiter.calls
+
+    def start(self) -> None:
+        """
+        Starts the session: finds the stale notes on a background thread, then refreshes them batch by batch.
+        """
+
+        self.deadline = time.monotonic() + self.config["session_seconds"]
+        self.cache = net.user_cache()
+        maxAge = self.config["max_age_days"] * 86400
+        self.mw.taskman.run_in_background(lambda: findStale(self.mw.col, self.ages, maxAge), self._onFound,
+            uses_collection=True)
+
+    def _stop(self, err: Optional[Exception] = None) -> None:
+        self.ages.close()
+        if self.cache is not None:
+            self.cache.close()
+        if err is not None:
+            from aqt.utils import tooltip
+            tooltip("Refreshing fame stopped: {}".format(err), parent=self.mw)
+
+    def _onFound(self, future: concurrent.futures.Future) -> None:
+        try:
+            self.stale = future.result()
+        except Exception as err:
+            self._stop(err)
+            return
+        self._nextBatch()
+
+    def _nextBatch(self) -> None:
+        budget = self.config["session_requests"] - self.requests
+        # An Add Fame run has the fetch path (see engine.FameEngine.run), and refreshes whatever it touches anyway
+        busy = wiki.limiter is not None
+        if not self.stale or budget <= 0 or time.monotonic() >= self.deadline or busy:
+            self._stop()
+            return
+        # Each note costs at most one request, so a batch cannot overrun the budget
+        size = min(self.config["batch_size"], budget)
+        batch, self.stale = self.stale[:size], self.stale[size:]
+        self.mw.taskman.run_in_background(lambda: self._refreshBatch(batch), self._onBatchDone, uses_collection=True)
+
+    def _refreshBatch(self, batch: List[Tuple['NoteId', str, str]]) -> int:
+        """
+        Fetches the pageviews of a batch of notes and writes those that changed, without an undo entry.  Runs on a
+        background thread.  The session's cache and rate limiter are only installed in wiki for the batch.
+
+        :return: How many notes changed
+        """
+
+        def fetch(row: Tuple['NoteId', str, str]) -> Optional[int]:
+            # Add Fame's fixed dates keep each article's URL (its cache key) the same from one session to the next, so
+            # a response older than max_age_days is revalidated rather than missed.  See benchmarks/revalidation.py.
+            try:
+                return wiki.shared_get_pageviews(row[2])
+            except Exception:
+                return None
+
+        old = wiki.cache, wiki.cache_max_age, wiki.limiter, wiki.article_flight
+        wiki.cache, wiki.cache_max_age, wiki.limiter = self.cache, self.config["max_age_days"] * 86400, self.limiter
+        wiki.article_flight = wiki.SingleFlight(keep=False)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(batch)) as executor:
+                pageviews = list(executor.map(fetch, batch))
+        finally:
+            wiki.cache, wiki.cache_max_age, wiki.limiter, wiki.article_flight = old
+
+        col = self.mw.col
+        changed = []
+        for (nid, fieldName, _), views in zip(batch, pageviews):
+            if views is None:
+                continue
+            self.ages.put(agesKey(nid, fieldName), views)
+            note = col.get_note(nid)
+            if note[fieldName] != str(views):
+                note[fieldName] = str(views)
+                changed.append(note)
+        if changed:
+            col.update_notes(changed, skip_undo_entry=True)
+        return len(changed)
+
+    def _onBatchDone(self, future: concurrent.futures.Future) -> None:
+        try:
+            self.refreshed += future.result()
+        except Exception as err:
+            self._stop(err)
+            return
+        self._nextBatch()
+
+
+def startRefresher(mw: 'AnkiQt', config: Dict[str, Any]) -> None:
+    """
+    Starts a refresh session after the configured delay (a profile has just been opened, and Anki is busy).
+
+    :param mw: The main window
+    :param config: The refresher's settings (see DEFAULT_CONFIG)
+    """
+
+    refresher = Refresher(mw, config)
+    delay = int(refresher.config["start_delay_seconds"] * 1000)
+    mw.progress.single_shot(delay, refresher.start, False)
@@ -0,0 +1,263 @@
+"""
+Fame scoring and ranking, shared by order.py and the add-on's "Order Notes by...".
+
+Each signal (pageviews, Google hits, age, ...) is a column with one value per note.  Columns are normalized to 0..1
+(by log scale or by percentile), combined with signed weights, and ranked with a single argsort:
+
+    order = rank({"pageviews": [120, None, 5000], "googlehits": [10, 20, 30]}, {"pageviews": 2, "googlehits": 1})
+    # order[0] is the index of the most famous note
+
+Missing values (None, "", NaN or "ERROR: ..." strings) are handled per column: they count as the least famous
+(missing="zero"), or the note is scored by its other columns only (missing="renormalize").
+
+Uses NumPy when it is installed (ranking 1M notes takes well under a second) and falls back to plain Python otherwise,
+since Anki does not ship NumPy.  read_columns reads the columns for a selection of notes with one query, and
+iter_fields streams the fields of many notes with one query per chunk.
+"""
+
+import math
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if TYPE_CHECKING:
+    from anki.collection import Collection
+    from anki.notes import NoteId
+
+Value = Optional[Union[int, float, str]]
+
+
+CHUNK_SIZE = 1000
+"""
+How many notes iter_fields reads with each query
+"""
+
+
+def iter_fields(
+    col: 'Collection',
+    nids: Sequence['NoteId'],
+    field_names: Optional[Sequence[str]] = None,
+    chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[Tuple['NoteId', Dict[str, str]]]:
+    """
+    Reads the fields of many notes with one query per chunk of notes, instead of one collection call per note.  Only
+    one chunk is held at a time, so this streams.
+
+    :param col: The collection
+    :param nids: The notes
+    :param field_names: The fields to read.  Defaults to all the fields of each note.  A field that a note's type lacks
+        is left out of its dict.
+    :param chunk_size: How many notes to read with each query
+    :return: (nid, {field name: value}) for each note, in the order of nids
+    """
+
+    ords: Dict[int, List[Tuple[str, int]]] = {}
+    for start in range(0, len(nids), chunk_size):
+        chunk = nids[start:start + chunk_size]
+        ids = "({})".format(",".join(str(nid) for nid in chunk))
+        rows = {nid: (mid, flds) for nid, mid, flds in col.db.execute("select id, mid, flds from notes where id in " + ids)}
+        for nid in chunk:
+            mid, flds = rows[nid]
+            if mid not in ords:
+                names = col.models.field_names(col.models.get(mid))
+                wanted = names if field_names is None else [name for name in field_names if name in names]
+                ords[mid] = [(name, names.index(name)) for name in wanted]
+            values = flds.split("\x1f")
+            yield nid, {name: values[ord] for name, ord in ords[mid]}
+
+
+def read_columns(col: 'Collection', nids: Sequence['NoteId'], field_names: Sequence[str]) -> Dict[str, List[Optional[str]]]:
+    """
+    Reads the given fields of all the notes (see iter_fields).  Notes whose note type lacks a field get None for it.
+
+    :param col: The collection
+    :param nids: The notes
+    :param field_names: The fields to read
+    :return: A map from field name to the field's value in each note, in the order of nids
+    """
+
+    columns: Dict[str, List[Optional[str]]] = {name: [] for name in field_names}
+    for _, fields in iter_fields(col, nids, field_names):
+        for name in field_names:
+            columns[name].append(fields.get(name))
+    return columns
+
+
+def to_float(value: Value) -> float:
+    """
+    Converts a field value to a float, with NaN for missing or unparsable values.
+
+    :param value: A number, a field's text, or None
+    :return: The value as a float, or NaN
+    """
+
+    if value is None:
+        return math.nan
+    if isinstance(value, str):
+        try:
+            return float(value.replace(",", "").strip())
+        except ValueError:
+            return math.nan
+    return float(value)
+
+
+def column(values: Sequence[Value]):
+    """
+    Converts a sequence of field values to a float column (a NumPy array if available), with NaN for missing values.
+    """
+
+    if np is not None:
+        if isinstance(values, np.ndarray) and values.dtype.kind == "f":
+            return values
+        try:
+            return np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            pass
+        return np.fromiter((to_float(v) for v in values), dtype=np.float64, count=len(values))
+    return [to_float(v) for v in values]
+
+
+def normalize(values: Sequence[Value], method: str = "log"):
+    """
+    Normalizes a column to 0..1, keeping NaN for missing values.
+
+    :param values: The column
+    :param method: "log" scales log(1 + value) by its maximum, which suits heavy-tailed counts like pageviews.
+        "percentile" uses each value's rank among the present values, which ignores scale entirely.  Tied values
+        share the average of their ranks.
+        "linear" scales min..max to 0..1.
+    :return: The normalized column
+    """
+
+    if np is None:
+        return _normalize_python(column(values), method)
+
+    x = column(values)
+    out = np.full(x.shape, np.nan)
+    present = ~np.isnan(x)
+    xs = x[present]
+    if xs.size == 0:
+        return out
+    if method == "log":
+        xs = np.log1p(np.maximum(xs, 0))
+        top = xs.max()
+        out[present] = xs / top if top > 0 else 0.0
+    elif method == "percentile":
+        # One argsort, then each run of equal values in sorted order gets the average of the ranks it spans
+        order = np.argsort(xs)
+        sorted_xs = xs[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_xs[1:] != sorted_xs[:-1])))
+        counts = np.diff(np.append(starts, xs.size))
+        ranks = np.empty(xs.size)
+        ranks[order] = np.repeat(starts + (counts - 1) / 2, counts)
+        out[present] = ranks / max(xs.size - 1, 1)
+    elif method == "linear":
+        lo, hi = xs.min(), xs.max()
+        out[present] = (xs - lo) / (hi - lo) if hi > lo else 0.0
+    else:
+        raise ValueError("Unknown normalization method: {}".format(method))
+    return out
+
+
+def score(
+    columns: Dict[str, Sequence[Value]],
+    weights: Dict[str, float],
+    methods: Optional[Dict[str, str]] = None,
+    missing: str = "zero",
+    ):
+    """
+    Combines normalized columns into one fame score per note.
+
+    :param columns: The columns, by name.  All must have the same length.
+    :param weights: The weight of each column, by name.  Negative weights make smaller values more famous (e.g. age).
+        Columns without a weight are ignored.
+    :param methods: The normalization method of each column (see normalize).  Defaults to "log".
+    :param missing: "zero" treats a missing value as 0 after normalization; "renormalize" scores a note by the
+        weighted mean of its present columns only.
+    :return: The score of each note (higher is more famous)
+    """
+
+    methods = methods or {}
+    names = [name for name in columns if weights.get(name)]
+    n = len(next(iter(columns.values()))) if columns else 0
+
+    if np is None:
+        return _score_python(columns, weights, methods, missing, names, n)
+
+    total = np.zeros(n)
+    weight_sum = np.zeros(n)
+    for name in names:
+        w = weights[name]
+        x = normalize(columns[name], methods.get(name, "log"))
+        present = ~np.isnan(x)
+        # A negative weight ranks small values first, so flip the column instead of subtracting
+        contribution = np.where(present, x if w > 0 else 1 - x, 0.0)
+        total += abs(w) * contribution
+        weight_sum += abs(w) * present
+    if missing == "renormalize":
+        return np.divide(total, weight_sum, out=np.zeros(n), where=weight_sum > 0)
+    if missing != "zero":
+        raise ValueError("Unknown missing value policy: {}".format(missing))
+    return total
+
+
+def rank(
+    columns: Dict[str, Sequence[Value]],
+    weights: Dict[str, float],
+    methods: Optional[Dict[str, str]] = None,
+    missing: str = "zero",
+    ) -> List[int]:
+    """
+    Ranks notes by fame, most famous first.  Ties keep their input order.
+
+    :return: The indices of the notes, most famous first.  See score for the parameters.
+    """
+
+    scores = score(columns, weights, methods, missing)
+    if np is None:
+        return sorted(range(len(scores)), key=lambda i: -scores[i])
+    return np.argsort(-scores, kind="stable").tolist()
+
+
+def _normalize_python(x: List[float], method: str) -> List[float]:
+    present = [v for v in x if not math.isnan(v)]
+    if not present:
+        return x
+    if method == "log":
+        top = max(math.log1p(max(v, 0)) for v in present)
+        return [v if math.isnan(v) else (math.log1p(max(v, 0)) / top if top > 0 else 0.0) for v in x]
+    if method == "percentile":
+        order = sorted((i for i, v in enumerate(x) if not math.isnan(v)), key=lambda i: x[i])
+        out = list(x)
+        start = 0
+        while start < len(order):
+            end = start
+            while end + 1 < len(order) and x[order[end + 1]] == x[order[start]]:
+                end += 1
+            for i in order[start:end + 1]:
+                out[i] = (start + end) / 2 / max(len(order) - 1, 1)
+            start = end + 1
+        return out
+    if method == "linear":
+        lo, hi = min(present), max(present)
+        return [v if math.isnan(v) else ((v - lo) / (hi - lo) if hi > lo else 0.0) for v in x]
+    raise ValueError("Unknown normalization method: {}".format(method))
+
+
+def _score_python(columns, weights, methods, missing, names, n) -> List[float]:
+    total = [0.0] * n
+    weight_sum = [0.0] * n
+    for name in names:
+        w = weights[name]
+        for i, v in enumerate(normalize(columns[name], methods.get(name, "log"))):
+            if not math.isnan(v):
+                total[i] += abs(w) * (v if w > 0 else 1 - v)
+                weight_sum[i] += abs(w)
+    if missing == "renormalize":
+        return [t / s if s > 0 else 0.0 for t, s in zip(total, weight_sum)]
+    if missing != "zero":
+        raise ValueError("Unknown missing value policy: {}".format(missing))
+    return total
@@ -0,0 +1,82 @@
+"""
+A compact, memory-mappable table of sorted byte keys and values, looked up by binary search in O(log n).
+
+    count (uint64) | count absolute record offsets (uint64) | count records
+
+Each record is key length (uint16) | value length (uint32) | key | value.  Used by titleindex and famepack.
+"""
+
+import struct
+from typing import BinaryIO, Iterator, Optional, Sequence, Tuple
+
+_count = struct.Struct("<Q")
+_offset = struct.Struct("<Q")
+_record = struct.Struct("<HI")
+
+
+def write_table(f: BinaryIO, records: Sequence[Tuple[bytes, bytes]]) -> None:
+    """
+    Writes a table at the current position of f.
+
+    :param f: A file opened for binary writing
+    :param records: The (key, value) records, sorted by key, with unique keys
+    """
+
+    pos = f.tell() + _count.size + _offset.size * len(records)
+    offsets = bytearray(_count.pack(len(records)))
+    for key, value in records:
+        offsets += _offset.pack(pos)
+        pos += _record.size + len(key) + len(value)
+    f.write(offsets)
+    for key, value in records:
+        f.write(_record.pack(len(key), len(value)) + key + value)
+
+
+class Table:
+    """
+    A read-only view of a table written by write_table, e.g. inside an mmap.
+    """
+
+    def __init__(self, buf, pos: int) -> None:
+        """
+        :param buf: The buffer (e.g. an mmap) holding the table
+        :param pos: Where the table starts in buf
+        """
+
+        self._buf = buf
+        self._pos = pos
+        self.count = _count.unpack_from(buf, pos)[0]
+
+    def record(self, i: int) -> Tuple[bytes, bytes]:
+        """
+        Returns the i-th (key, value) record in key order.
+        """
+
+        start = _offset.unpack_from(self._buf, self._pos + _count.size + _offset.size * i)[0]
+        key_len, value_len = _record.unpack_from(self._buf, start)
+        start += _record.size
+        return self._buf[start:start + key_len], self._buf[start + key_len:start + key_len + value_len]
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """
+        Returns the value for key, or None if key is not in the table.
+        """
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, value = self.record(mid)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return value
+        return None
+
+    def items(self) -> Iterator[Tuple[bytes, bytes]]:
+        for i in range(self.count):
+            yield self.record(i)
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,205 @@
+"""
+An offline index of Wikipedia article titles and redirects, so that search phrases which exactly match a title
+(or a redirect) can be resolved without asking opensearch.
+
+Build one from the dumps at https://dumps.wikimedia.org/enwiki/latest/:
+
+    python -m orderanki.titleindex enwiki-latest-all-titles-in-ns0.gz redirects.tsv.gz titles.idx
+
+The all-titles dump has one title per line (underscores for spaces).  The redirect file has one redirect per line,
+as tab-separated "source title<TAB>target title" (e.g. extracted from the page and redirect SQL dumps).
+
+The index file is a sortedtable of lookup key -> title after a MAGIC header.  It is memory-mapped, so a lookup is a
+binary search touching a few pages.
+"""
+
+from argparse import ArgumentParser
+import bz2
+import gzip
+import mmap
+import re
+from typing import Dict, IO, Iterable, Iterator, Optional, Tuple
+from urllib.parse import unquote
+
+try:
+    from . import sortedtable
+except ImportError: # Running this module by itself for dev purposes
+    import sortedtable
+
+MAGIC = b"OAKTIDX2"
+_whitespace_re = re.compile(r"\s+")
+
+
+def title_key(title: str) -> str:
+    """
+    Returns the lookup key of a title or search phrase: underscores become spaces, whitespace is folded, and the
+    result is case-folded.  "Stoke-on-Trent", "stoke-on-trent" and "Stoke-on-Trent_" all share a key.
+
+    :param title: A title or search phrase
+    :return: The lookup key
+    """
+
+    return _whitespace_re.sub(" ", title.replace("_", " ")).strip().casefold()
+
+
+def article_key(article: str) -> str:
+    """
+    Returns the lookup key of an article title, so that "Are_You_the_One%3F" and "are You the One?" share a key.
+
+    :param article: The title of the article, as a URL string or plain title
+    :return: The lookup key
+    """
+
+    title = unquote(article).replace(" ", "_")
+    return title[:1].upper() + title[1:]
+
+
+def _upper_count(title: str) -> int:
+    return sum(1 for c in title if c.isupper())
+
+
+def _open_dump(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "rt", encoding="utf-8", errors="replace")
+
+
+def read_titles(path: str) -> Iterator[str]:
+    """
+    Yields the titles in an all-titles dump, skipping the "page_title" header line if there is one.
+
+    :param path: The path to the dump, optionally .gz or .bz2 compressed
+    """
+
+    with _open_dump(path) as f:
+        for line in f:
+            title = line.rstrip("\n")
+            if title and title != "page_title":
+                yield title
+
+
+def read_redirects(path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the (source, target) title pairs in a tab-separated redirect file.
+
+    :param path: The path to the redirect file, optionally .gz or .bz2 compressed
+    """
+
+    with _open_dump(path) as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 2 and parts[0] and parts[1]:
+                yield parts[0], parts[1]
+
+
+def build_index(
+    titles: Iterable[str],
+    redirects: Iterable[Tuple[str, str]],
+    out_path: str,
+    ) -> int:
+    """
+    Builds an index file from titles and redirects.  Exact titles take priority over redirects sharing a key, and
+    redirect chains are followed (a few hops) to their final target.
+
+    :param titles: The article titles, e.g. from read_titles
+    :param redirects: The (source, target) redirect pairs, e.g. from read_redirects
+    :param out_path: Where to write the index
+    :return: The number of keys in the index
+    """
+
+    # The all-titles dump lists redirect pages too, so read the redirects first to know which titles are real articles
+    targets: Dict[str, str] = {}
+    for source, target in redirects:
+        targets[source.replace(" ", "_")] = target.replace(" ", "_")
+
+    entries: Dict[str, str] = {}
+    canonical = set()
+    for title in titles:
+        title = title.replace(" ", "_")
+        if title in targets:
+            continue
+        canonical.add(title)
+        key = title_key(title)
+        # Of titles differing only in case ("APPLE", "Apple"), prefer the least shouty one, as opensearch does
+        if key not in entries or _upper_count(title) < _upper_count(entries[key]):
+            entries[key] = title
+
+    for source, target in targets.items():
+        for _ in range(5):
+            if target in canonical or target not in targets:
+                break
+            target = targets[target]
+        entries.setdefault(title_key(source), target)
+    del canonical, targets
+
+    records = sorted((key.encode("utf-8"), title.encode("utf-8")) for key, title in entries.items())
+    del entries
+
+    with open(out_path, "wb") as f:
+        f.write(MAGIC)
+        sortedtable.write_table(f, records)
+    return len(records)
+
+
+class TitleIndex:
+    """
+    A memory-mapped, read-only title index built by build_index.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: The path to an index file built by build_index
+        """
+
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{} is not a title index".format(path))
+        self._table = sortedtable.Table(self._mm, len(MAGIC))
+        self.count = len(self._table)
+
+    def lookup_title(self, phrase: str) -> Optional[str]:
+        """
+        Returns the title (with underscores) that phrase exactly matches, or redirects to, or None.
+
+        :param phrase: A title or search phrase
+        :return: The title of the article, or None if the phrase is not in the index
+        """
+
+        title = self._table.get(title_key(phrase).encode("utf-8"))
+        return None if title is None else title.decode("utf-8")
+
+    def titles(self) -> Iterator[str]:
+        """
+        Yields every distinct title in the index, in key order.
+        """
+
+        seen = set()
+        for _, title in self._table.items():
+            title = title.decode("utf-8")
+            if title not in seen:
+                seen.add(title)
+                yield title
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Build an offline title and redirect index for orderanki.")
+    parser.add_argument("titles", help="path to an all-titles dump (one title per line, optionally .gz/.bz2)")
+    parser.add_argument("redirects", help="path to a tab-separated 'source<TAB>target' redirect file, or '-' for none")
+    parser.add_argument("out", help="where to write the index")
+    args = parser.parse_args()
+
+    redirects = read_redirects(args.redirects) if args.redirects != "-" else []
+    n = build_index(read_titles(args.titles), redirects, args.out)
+    print("Wrote {} keys to {}".format(n, args.out))
@@ -1,115 +1,587 @@
-from copy import deepcopy
+from argparse import ArgumentParser
+import concurrent.futures
+import contextlib
+import itertools
 import json
 import os
+import re
 import requests
-from typing import Union, Dict, List, Optional
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterable, Iterator, Union, Dict, List, Optional, Tuple
 from urllib import parse
 from urllib.parse import unquote
 from time import sleep
 
-# If running this module by itself for dev purposes, you can change the verbosity by changing the "v: int = 1" line
+try:
+    from . import cassette, famepack, fuzzy, net, titleindex
+except ImportError: # Running this module by itself for dev purposes
+    import cassette, famepack, fuzzy, net, titleindex
+
+if TYPE_CHECKING:
+    from anki.notes import Note, NoteId
+    from aqt import AnkiQt
+
+# When running this module by itself (see main), the verbosity is set with -v
 verbose: int = 0
-v: int = 1
 
 headers = {'User-Agent': 'AutoankiBot/0.1 (https://github.com/Eliclax/autoanki; tw2000x@gmail.com)'}
 
-if __name__ == "__main__":
-    verbose = v
-else:
-    class Wikifame:
+
+cache: Optional[net.Cache] = None
+"""
+An optional cache of API responses, keyed by URL.  If set, get_json answers repeated requests from it.
+"""
+
+cache_max_age: Optional[float] = None
+"""
+The oldest cached response (in seconds) that get_json will use as is.  None accepts any age.  An older response is
+revalidated: if it came with an ETag or Last-Modified header, the request is made conditional, and a 304 Not Modified
+answer (which has no body) counts as a cache hit.
+"""
+
+limiter: Optional[net.RateLimiter] = None
+"""
+An optional rate limiter that every request made by get_json waits on.
+"""
+
+hedger: Optional[net.Hedger] = None
+"""
+An optional net.Hedger.  If set, a get_json call slower than the recent p95 for its host sends one duplicate request
+(within the hedger's budget), and the first response wins.
+"""
+
+tape: Optional[cassette.Cassette] = None
+"""
+An optional cassette that get_json records every response to, or replays them from (with no network, and without
+waiting on the limiter).  See cassette.Cassette.
+"""
+
+_session_local = threading.local()
+
+
+def _session() -> requests.Session:
+    session = getattr(_session_local, "session", None)
+    if session is None:
+        session = _session_local.session = requests.Session()
+        session.headers.update(headers)
+    return session
+
+
+def get_json(url: str, params: Optional[Dict[str, str]] = None, timeout: float = 5) -> Any:
+    """
+    Gets a URL and returns its JSON body.  All of this module's requests go through here, so that they share the
+    cache, the rate limiter, request hedging, the cassette (tape) and (per thread) a keep-alive connection.  Cached
+    responses older than cache_max_age are revalidated with a conditional request where possible.
+
+    :param url: The URL
+    :param params: Optional query parameters, added to the URL
+    :param timeout: How many seconds to wait for the server to send data before giving up.
+    :return: The decoded JSON body.  Raises requests.HTTPError on an HTTP error status.
+    """
+
+    key = url + ("&" if "?" in url else "?") + parse.urlencode(params) if params else url
+    stale = None
+    conditional: Dict[str, str] = {}
+    if cache is not None:
+        stale = cache.entry(key)
+        if stale is not None:
+            contents, fetched_at, etag, last_modified = stale
+            if cache_max_age is None or time.time() - fetched_at <= cache_max_age:
+                return contents
+            if etag:
+                conditional["If-None-Match"] = etag
+            if last_modified:
+                conditional["If-Modified-Since"] = last_modified
+    if limiter is not None and not (tape is not None and tape.replaying):
+        limiter.acquire()
+
+    validators: Dict[str, Optional[str]] = {}
+    copies = itertools.count()
+
+    def fetch() -> Tuple[int, bytes]:
+        # The first copy's slot was taken above, so the hedger only times the request itself.  A hedged copy takes a
+        # slot of its own, so hedging cannot push the rate past the limit.
+        if limiter is not None and next(copies) > 0:
+            limiter.acquire()
+        resp = _session().get(url, params=params, timeout=timeout, headers=conditional or None)
+        # Hedged copies of the request get the same resource, so either one's validators will do
+        validators["etag"] = resp.headers.get("ETag")
+        validators["last_modified"] = resp.headers.get("Last-Modified")
+        return resp.status_code, resp.content
+
+    if hedger is not None and not (tape is not None and tape.replaying):
+        send = lambda: hedger.call(fetch, key=parse.urlsplit(url).netloc)
+    else:
+        send = fetch
+    status, body = send() if tape is None else tape.fetch(key, send)
+    if status == 304 and stale is not None:
+        cache.touch(key)
+        return stale[0]
+    if status >= 300:
+        raise requests.HTTPError("{} HTTP Error for url: {}".format(status, key))
+    contents = json.loads(body)
+    if cache is not None:
+        cache.put(key, contents, validators.get("etag"), validators.get("last_modified"))
+    return contents
+
+
+class SingleFlight:
+    """
+    Coalesces calls that share a key, so that a key is only ever fetched once.
+
+    The first caller for a key runs the function; every concurrent (or later) caller with the same key
+    waits on the same future and gets the same result.  Failed calls are forgotten so they can be retried.
+    """
+
+    def __init__(self, keep: bool = True) -> None:
         """
-        The class representing the data structure containing all Anki and Wikipedia data
+        :param keep: If False, finished calls are forgotten at once, so only calls in flight are shared.  This keeps
+            memory bounded on huge inputs (pair it with a cache).
         """
 
-        from anki.notes import Note, NoteId
-        from aqt import AnkiQt
-
-        def __init__(
-            self,
-            mw: Optional[AnkiQt],
-            nid: Optional[NoteId] = None,
-            note: Optional[Note] = None,
-            search_phrase: Optional[str] = None,
-            pageviews_field_name: Optional[str] = None,
-            pageviews: Optional[int] = None,
-            article_field_name: Optional[str] = None,
-            article: Optional[str] = None,
-            article_fixed_field_name: Optional[str] = None,
-            article_fixed: Optional[str] = None,
-            desc_field_name: Optional[str] = None,
-            desc: Optional[str] = None,
-            project: Optional[str] = None,
-            ) -> None:
-            """
-            Must contain search_phrase or article
-            """
-
-            assert search_phrase or article
-
-            self.mw = mw
-            self.nid = nid
-            self.note = note
-            if self.note is None and self.nid is not None:
-                self.note = self.mw.col.get_note(self.nid)
-            self.search_phrase = search_phrase
-            self.fields: Dict = {}
-            self.field_names: Dict = {}
-            self.fields["article"] = article
-            self.field_names["article"] = article_field_name
-            self.fields["article_fixed"] = article_fixed
-            self.field_names["article_fixed"] = article_fixed_field_name
-            self.fields["desc"] = desc
-            self.field_names["desc"] = desc_field_name
-            self.fields["pageviews"] = pageviews
-            self.field_names["pageviews"] = pageviews_field_name
-            self.project = project
-
-        def set(self, field: str, value: Optional[Union[str, int]]) -> None:
-            """
-            Sets the python field and the Anki field to be equal to value.
-
-            :param field: The name of the field, must be one of: article, article_fixed, desc, pageviews
-            :param value: The value to set the field as
-            """
-
-            self.fields[field] = value
-            if self.field_names[field] is not None:
-                if value is None:
-                    self.note[self.field_names[field]] = ""
-                else:
-                    self.note[self.field_names[field]] = str(value)
-            self.mw.col.update_note(self.note)
-
-        def search_up_article(self, timeout: float = 5) -> 'Wikifame':
-            try:
-                article = search_article_url(self.search_phrase, timeout)
-                self.set("article",article)
-                self.set("article_fixed",article)
-            except requests.HTTPError:
-                self.set("article","ERROR: HTTP Error")
-                self.set("article_fixed","ERROR: HTTP Error")
-                raise
-            return self
-
-        def fill_pageviews(self, timeout: float = 5) -> 'Wikifame':
-            try:
-                pageviews = get_pageviews(self.fields["article"], self.project, timeout=timeout)
-                self.set("pageviews",pageviews)
-            except requests.HTTPError:
-                self.set("pageviews","ERROR: HTTP Error")
-                raise
-            return self
-
-        def fill_description(self, timeout: float = 5) -> 'Wikifame':
-            # if self.fields["article"] is None:
-            #     self.search_up_article(timeout=timeout)
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._futures: Dict[Hashable, concurrent.futures.Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Returns fn(*args, **kwargs), sharing the call with every other caller using the same key.
+
+        :param key: The key identifying the call, e.g. a normalized search phrase
+        :param fn: The function to call if no call for key is in flight or finished
+        :return: The result of the (shared) call.  Raises whatever the shared call raised.
+        """
+
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._futures[key] = future
+        if leader:
             try:
-                desc = get_desc1(self.fields["article"], timeout=timeout)
-                self.set("desc", desc)
-            except requests.HTTPError:
-                self.set("desc", "ERROR: HTTP Error")
-                raise
-            return self
+                result = fn(*args, **kwargs)
+            except BaseException as err:
+                with self._lock:
+                    del self._futures[key]
+                future.set_exception(err)
+            else:
+                if not self.keep:
+                    with self._lock:
+                        del self._futures[key]
+                future.set_result(result)
+        return future.result()
+
+    def clear(self) -> None:
+        """
+        Forgets all finished calls.  Calls still in flight are left alone.
+        """
+
+        with self._lock:
+            self._futures = {k: f for k, f in self._futures.items() if not f.done()}
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+
+class Batcher:
+    """
+    Gathers single lookups made from many threads into batched calls, for APIs that take many keys per request.
+
+    A batch is sent as soon as size distinct keys are waiting, or delay seconds after the first key arrived.  Every
+    caller waits for (and gets its own entry from) the batch its key went out in.
+    """
+
+    def __init__(self, fn: Callable[[List[Hashable]], Dict[Hashable, Any]], size: int = 50, delay: float = 0.05) -> None:
+        """
+        :param fn: Fetches a batch: takes a list of keys and returns a map from key to result (missing keys get None)
+        :param size: The most keys per batch
+        :param delay: How many seconds a key may wait for its batch to fill up
+        """
+
+        self.fn = fn
+        self.size = size
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending: Dict[Hashable, concurrent.futures.Future] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Returns key's entry from a batched call of fn.  Raises whatever that call raised.
+        """
+
+        batch = None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = concurrent.futures.Future()
+                self._pending[key] = future
+                if len(self._pending) >= self.size:
+                    batch = self._take()
+                elif self._timer is None:
+                    self._timer = threading.Timer(self.delay, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._run(batch)
+        return future.result()
+
+    def _take(self) -> Dict[Hashable, concurrent.futures.Future]:
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch: Dict[Hashable, concurrent.futures.Future]) -> None:
+        try:
+            results = self.fn(list(batch))
+        except BaseException as err:
+            for future in batch.values():
+                future.set_exception(err)
+            return
+        for key, future in batch.items():
+            future.set_result(results.get(key))
+
+
+title_index: Optional[titleindex.TitleIndex] = None
+"""
+An optional offline title and redirect index.  If set, search phrases that exactly match a title or a redirect are
+resolved locally, and only the misses are searched on en.wikipedia.org.  See load_title_index.
+"""
+
+fuzzy_index: Optional[fuzzy.FuzzyIndex] = None
+"""
+An optional local fuzzy search over titles, tried after title_index.  See load_fuzzy_index.
+"""
+
+fuzzy_min_score: float = 0.8
+"""
+The lowest fuzzy_index score accepted as a match.  Phrases scoring lower are searched on en.wikipedia.org.
+"""
+
+offline: bool = False
+"""
+If True, resolve_article never searches en.wikipedia.org; phrases with no local match resolve to None.
+"""
+
+fame_pack: Optional[famepack.FamePack] = None
+"""
+An optional fame pack of precomputed fame data.  Search phrases, pageviews and descriptions found in it are used
+instead of fetching (pageviews only for requests over the pack's project and dates).  See load_fame_pack.
+"""
+
+search_flight = SingleFlight()
+"""
+Shares search_article_url calls between search phrases that normalize to the same key
+"""
+
+article_flight = SingleFlight()
+"""
+Shares get_pageviews, get_desc1 and sitelink calls between notes that resolve to the same article
+"""
+
+sitelinks_batcher = Batcher(lambda keys: _get_sitelinks_keyed(keys))
+"""
+Gathers shared_get_sitelinks calls from the engine's worker threads into batches of 50 (title, timeout) keys
+"""
+
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_phrase(search_phrase: str) -> str:
+    """
+    Returns the key used to coalesce search phrases: case-folded, with runs of whitespace folded into one space.
+
+    :param search_phrase: The search phrase
+    :return: The normalized search phrase
+    """
+
+    return _whitespace_re.sub(" ", search_phrase).strip().casefold()
+
+
+def normalize_article(article: str) -> str:
+    """
+    Returns the key used to coalesce article titles, so that "Are_You_the_One%3F" and "Are You the One?" match.
+
+    :param article: The title of the article, as a URL string
+    :return: The normalized title
+    """
+
+    return titleindex.article_key(article)
+
+
+def shared_search_article_url(search_phrase: str, timeout: float = 5) -> Optional[str]:
+    """
+    Like search_article_url, but shared between all identical (after normalize_phrase) search phrases.
+    """
+
+    if fame_pack is not None:
+        article = fame_pack.article(search_phrase)
+        if article is not None:
+            return article
+    return search_flight.do(normalize_phrase(search_phrase), resolve_article, search_phrase, timeout)
+
+
+def shared_get_pageviews(
+    article: Optional[str],
+    project: str = "en.wikipedia.org",
+    timeout: float = 5,
+    start: str = "20150701",
+    end: str = "20230101",
+    ) -> int:
+    """
+    Like get_pageviews, but shared between all notes that resolve to the same article.  The fame pack's pageviews are
+    only used if they cover the same project and dates.
+    """
+
+    if not article:
+        return get_pageviews(article, project, start=start, end=end, timeout=timeout)
+    if fame_pack is not None and fame_pack.covers(project, start, end):
+        pageviews = fame_pack.pageviews(article)
+        if pageviews is not None:
+            return pageviews
+    key = ("pageviews", project, start, end, normalize_article(article))
+    return article_flight.do(key, get_pageviews, article, project, start=start, end=end, timeout=timeout)
+
+
+def shared_get_desc1(article: Optional[str], timeout: float = 5) -> str:
+    """
+    Like get_desc1, but shared between all notes that resolve to the same article.
+    """
+
+    if not article:
+        return get_desc1(article, timeout=timeout)
+    if fame_pack is not None:
+        desc = fame_pack.desc(article)
+        if desc is not None:
+            return desc
+    return article_flight.do(("desc", normalize_article(article)), get_desc1, article, timeout=timeout)
+
+
+def shared_get_sitelinks(article: Optional[str], timeout: float = 5) -> Union[int, str]:
+    """
+    Like get_sitelinks for a single article, but shared between all notes that resolve to the same article, and batched
+    with the concurrent calls for other articles (50 per request) by sitelinks_batcher.
+    """
+
+    if not article:
+        return ""
+    title = unquote(article).replace("_", " ")
+    return article_flight.do(("sitelinks", normalize_article(article)), sitelinks_batcher.get, (title, timeout))
+
+
+FAME_FIELDS = ("article", "article_fixed", "desc", "pageviews", "sitelinks")
+"""
+The fame fields of a Wikifame, in the order of their bits in Wikifame._dirty
+"""
+
+
+class FieldNames:
+    """
+    The names of the Anki fields that a Wikifame's fame fields are written to.  One is shared by every Wikifame of a run.
+    """
+
+    __slots__ = FAME_FIELDS
+
+    def __init__(
+        self,
+        pageviews: Optional[str] = None,
+        article: Optional[str] = None,
+        article_fixed: Optional[str] = None,
+        desc: Optional[str] = None,
+        sitelinks: Optional[str] = None,
+        ) -> None:
+        self.pageviews = pageviews
+        self.article = article
+        self.article_fixed = article_fixed
+        self.desc = desc
+        self.sitelinks = sitelinks
+
+    @staticmethod
+    def named_after(field_name: str) -> 'FieldNames':
+        """
+        Returns the field names used by the Add Fame dialog, e.g. "Wiki Pageviews", "Wiki Pageviews (URL)", ...
+
+        :param field_name: The name of the pageviews field
+        """
+
+        return FieldNames(field_name, field_name + " (URL)", field_name + " (URL fixed)", field_name + " (Description)",
+            field_name + " (Sitelinks)")
+
+    def __getitem__(self, field: str) -> Optional[str]:
+        return getattr(self, field)
+
+    def items(self) -> Iterator:
+        for field in FAME_FIELDS:
+            yield field, getattr(self, field)
+
+
+class Wikifame:
+    """
+    The class representing the data structure containing all Anki and Wikipedia data.
+
+    It is a compact __slots__ record: there can be 100k of these in a run, so per-note state is kept to plain
+    attributes, and the field names are a FieldNames shared by the whole run.
+    """
+
+    __slots__ = ("mw", "nid", "_note", "current", "search_phrase", "project", "field_names", "_dirty") + FAME_FIELDS
+
+    def __init__(
+        self,
+        mw: Optional['AnkiQt'],
+        nid: Optional['NoteId'] = None,
+        note: Optional['Note'] = None,
+        search_phrase: Optional[str] = None,
+        pageviews_field_name: Optional[str] = None,
+        pageviews: Optional[int] = None,
+        article_field_name: Optional[str] = None,
+        article: Optional[str] = None,
+        article_fixed_field_name: Optional[str] = None,
+        article_fixed: Optional[str] = None,
+        desc_field_name: Optional[str] = None,
+        desc: Optional[str] = None,
+        sitelinks_field_name: Optional[str] = None,
+        sitelinks: Optional[int] = None,
+        project: Optional[str] = None,
+        field_names: Optional[FieldNames] = None,
+        current: Optional[Dict[str, str]] = None,
+        ) -> None:
+        """
+        Must contain search_phrase or article.  Give either field_names (shared) or the individual *_field_name.
+        current is a snapshot of the note's fields (see scoring.iter_fields): write compares against it, and only
+        loads the note if something changed.
+        """
+
+        assert search_phrase or article
+
+        self.mw = mw
+        self.nid = nid
+        self._note = note
+        self.current = current
+        self._dirty = 0
+        self.search_phrase = search_phrase
+        self.article = article
+        self.article_fixed = article_fixed
+        self.desc = desc
+        self.pageviews = pageviews
+        self.sitelinks = sitelinks
+        if field_names is None:
+            field_names = FieldNames(pageviews_field_name, article_field_name, article_fixed_field_name, desc_field_name,
+                sitelinks_field_name)
+        self.field_names = field_names
+        self.project = project
+
+    @property
+    def fields(self) -> Dict[str, Optional[Union[str, int]]]:
+        """
+        The fame fields, as a dict (built on each access).
+        """
+
+        return {field: getattr(self, field) for field in FAME_FIELDS}
+
+    @property
+    def note(self) -> 'Note':
+        """
+        The Anki note, loaded on first use so that waiting Wikifames do not hold whole notes in memory.
+        """
+
+        if self._note is None:
+            self._note = self.mw.col.get_note(self.nid)
+        return self._note
+
+    def set(self, field: str, value: Optional[Union[str, int]]) -> None:
+        """
+        Sets the python field to be equal to value.  The Anki field is set by write, so that fetching (which may
+        happen on any thread) never touches the collection.
+
+        :param field: The name of the field, must be one of: article, article_fixed, desc, pageviews, sitelinks
+        :param value: The value to set the field as
+        """
+
+        setattr(self, field, value)
+        self._dirty |= 1 << FAME_FIELDS.index(field)
+
+    def write(self, pending: Optional[List['Note']] = None) -> bool:
+        """
+        Sets every named Anki field that was set since the last write, and updates the note once if any of them
+        changed.  Notes whose fields already hold the same values are not written at all, so reruns do not bump their
+        mtime and usn (and add nothing to undo or sync).  With a current snapshot, such notes are not even loaded.
+        Must be called on the main thread.  The note is let go of afterwards.
+
+        :param pending: If given, a changed note is added to it (for the caller to update with the others in one
+            update_notes call) instead of being updated now
+        :return: Whether the note changed (and was, or is to be, written)
+        """
+
+        values = {}
+        for bit, field in enumerate(FAME_FIELDS):
+            name = self.field_names[field]
+            if self._dirty & (1 << bit) and name is not None:
+                value = getattr(self, field)
+                values[name] = "" if value is None else str(value)
+        self._dirty = 0
+        current = self.current if self.current is not None else self.note
+        changed = {name: value for name, value in values.items() if current[name] != value}
+        if changed:
+            note = self.note
+            for name, value in changed.items():
+                note[name] = value
+            if pending is not None:
+                pending.append(note)
+            else:
+                self.mw.col.update_note(note)
+        self._note = None
+        self.current = None
+        return bool(changed)
+
+    def search_up_article(self, timeout: float = 5) -> 'Wikifame':
+        try:
+            article = shared_search_article_url(self.search_phrase, timeout)
+            self.set("article",article)
+            self.set("article_fixed",article)
+        except requests.HTTPError:
+            self.set("article","ERROR: HTTP Error")
+            self.set("article_fixed","ERROR: HTTP Error")
+            raise
+        return self
+
+    def fill_pageviews(self, timeout: float = 5) -> 'Wikifame':
+        try:
+            pageviews = shared_get_pageviews(self.article, self.project, timeout=timeout)
+            self.set("pageviews",pageviews)
+        except requests.HTTPError:
+            self.set("pageviews","ERROR: HTTP Error")
+            raise
+        return self
+
+    def fill_description(self, timeout: float = 5) -> 'Wikifame':
+        # if self.article is None:
+        #     self.search_up_article(timeout=timeout)
+        try:
+            desc = shared_get_desc1(self.article, timeout=timeout)
+            self.set("desc", desc)
+        except requests.HTTPError:
+            self.set("desc", "ERROR: HTTP Error")
+            raise
+        return self
+
+    def fill_sitelinks(self, timeout: float = 5) -> 'Wikifame':
+        try:
+            self.set("sitelinks", shared_get_sitelinks(self.article, timeout))
+        except requests.HTTPError:
+            self.set("sitelinks", "ERROR: HTTP Error")
+            raise
+        return self
 
 
 def search_article_url(search_phrase: str, timeout: float = 5) -> Optional[str]:
@@ -124,20 +596,101 @@ def search_article_url(search_phrase: str, timeout: float = 5) -> Optional[str]:
     search_url = "https://en.wikipedia.org/w/api.php?action=opensearch&search="
     search_url += parse.quote(search_phrase)
     search_url += "&limit=10&namespace=0&format=json"
+    contents = get_json(search_url, timeout=timeout)
     try:
-        resp = requests.get(search_url, headers=headers, timeout=timeout)
-        resp.raise_for_status()
-    except requests.HTTPError:
-        raise
-    try:
-        contents: str = resp.json()
         article = os.path.basename(parse.urlparse(contents[3][0]).path)
-    except:
+    except (IndexError, KeyError, TypeError):
+        # No results
         article = None
     if verbose >= 1:
         print("   > Searched: {} -> {}".format(search_phrase, article))
     return article
 
+def title_to_article(title: str) -> str:
+    """
+    Turns a title into a URL string the same way en.wikipedia.org does, e.g. "Are You the One?" -> "Are_You_the_One%3F".
+
+    :param title: The title of the article
+    :return: The title of the article, as a URL string
+    """
+
+    return parse.quote(title.replace(" ", "_"), safe=";@$!*(),/~:")
+
+
+def load_title_index(path: Optional[str]) -> None:
+    """
+    Sets (or, given None, unsets) the offline title index used by resolve_article.
+
+    :param path: The path to an index built with "python -m orderanki.titleindex"
+    """
+
+    global title_index
+    if title_index is not None:
+        title_index.close()
+    title_index = titleindex.TitleIndex(path) if path else None
+
+
+def load_fuzzy_index(path: Optional[str], popularity: Optional[Dict[str, int]] = None) -> None:
+    """
+    Sets (or, given None, unsets) the local fuzzy search used by resolve_article.
+
+    :param path: Either a FuzzyIndex saved with FuzzyIndex.save, or an index built with "python -m orderanki.titleindex"
+    :param popularity: An optional map from title (with underscores) to pageviews, used to rank candidates
+    """
+
+    global fuzzy_index
+    if not path:
+        fuzzy_index = None
+        return
+    with open(path, "rb") as f:
+        is_title_index = f.read(len(titleindex.MAGIC)) == titleindex.MAGIC
+    if is_title_index:
+        index = titleindex.TitleIndex(path)
+        fuzzy_index = fuzzy.FuzzyIndex(index.titles())
+        index.close()
+    else:
+        fuzzy_index = fuzzy.FuzzyIndex.load(path)
+    if popularity:
+        fuzzy_index.set_popularity(popularity)
+
+
+def load_fame_pack(path: Optional[str]) -> None:
+    """
+    Sets (or, given None, unsets) the fame pack used by the shared_* functions.
+
+    :param path: The path to a fame pack, see famepack.write_pack
+    """
+
+    global fame_pack
+    if fame_pack is not None:
+        fame_pack.close()
+    fame_pack = famepack.FamePack(path) if path else None
+
+
+def resolve_article(search_phrase: str, timeout: float = 5) -> Optional[str]:
+    """
+    Like search_article_url, but first tries the offline title index for an exact or redirect match, then the local
+    fuzzy search (whichever are loaded).  If offline is set, en.wikipedia.org is never searched.
+
+    :param search_phrase: The search phrase that you want to search en.wikipedia.org with.
+    :param timeout: How many seconds to wait for the server to send data before giving up.
+    :return: The title of the article, as a URL string.
+    """
+
+    title = None
+    if title_index is not None:
+        title = title_index.lookup_title(search_phrase)
+    if title is None and fuzzy_index is not None:
+        title = fuzzy_index.best_title(search_phrase, fuzzy_min_score)
+    if title is not None:
+        article = title_to_article(title)
+        if verbose >= 1:
+            print("   > Found locally: {} -> {}".format(search_phrase, article))
+        return article
+    if offline:
+        return None
+    return search_article_url(search_phrase, timeout)
+
 def get_pageviews(
     article: Optional[str], 
     project: str = "en.wikipedia.org",
@@ -169,12 +722,7 @@ def get_pageviews(
     if article != "":
         wiki_url = "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/"
         wiki_url += "{}/{}/{}/{}/{}/{}/{}".format(project, access, agent, article, granularity, start, end)
-        try:
-            resp = requests.get(wiki_url, headers=headers, timeout=timeout)
-            resp.raise_for_status()
-        except requests.HTTPError:
-            raise
-        contents: str = resp.json()
+        contents = get_json(wiki_url, timeout=timeout)
         if verbose >= 2:
             print(json.dumps(contents, indent=4))
         for item in contents["items"]:
@@ -193,13 +741,8 @@ def get_desc1(article: Optional[str], timeout: float = 5) -> str:
     """
 
     search_url = "https://en.wikipedia.org/w/api.php?format=json&action=query&prop=description&titles={}".format(article)
+    contents = get_json(search_url, timeout=timeout)
     try:
-        resp = requests.get(search_url, headers=headers, timeout=timeout)
-        resp.raise_for_status()
-    except requests.HTTPError:
-        raise
-    try:
-        contents: str = resp.json()
         for page in contents["query"]["pages"]:
             desc = contents["query"]["pages"][page]["description"]
     except:
@@ -209,61 +752,263 @@ def get_desc1(article: Optional[str], timeout: float = 5) -> str:
     return desc
 
 
-def get_desc(articles: List[Optional[str]] = [], timeout: float = 5) -> List[str]:
+def _query_pages(titles: List[str], params: Dict[str, str], timeout: float = 5) -> Dict[str, Dict[str, Any]]:
     """
-    Given a list of article titles, returns a list of short descriptions. (Makes ceil(n/50) queries to Wikipedia.)
-    
+    Runs an action=query request for up to 50 titles, and returns each title's page, keyed by the titles as given
+    (following the API's normalization and redirects).  Titles with no page get {}.
+    """
+
+    url = "https://en.wikipedia.org/w/api.php"
+    params = dict(params, format="json", action="query", redirects="1", titles="|".join(titles))
+    query = get_json(url, params, timeout=timeout).get("query", {})
+
+    normalized = {n["from"]: n["to"] for n in query.get("normalized", [])}
+    redirects = {r["from"]: r["to"] for r in query.get("redirects", [])}
+    pages = {page["title"]: page for page in query.get("pages", {}).values()}
+
+    found: Dict[str, Dict[str, Any]] = {}
+    for title in titles:
+        resolved = normalized.get(title, title)
+        for _ in range(len(redirects) + 1):
+            if resolved not in redirects:
+                break
+            resolved = redirects[resolved]
+        found[title] = pages.get(resolved, {})
+    return found
+
+
+def _get_desc_batch(titles: List[str], timeout: float = 5) -> Dict[str, str]:
+    """
+    Returns the short descriptions of up to 50 titles, keyed by the titles as given, following normalization and redirects.
+    """
+
+    descs: Dict[str, str] = {}
+    for title, page in _query_pages(titles, {"prop": "description"}, timeout).items():
+        descs[title] = page.get("description", "ERROR: No short description found.")
+        if verbose >= 1:
+            print("   > Got description: {} | {} | {}".format(title, page.get("title"), descs[title]))
+    return descs
+
+
+def get_desc(articles: List[Optional[str]] = [], timeout: float = 5, workers: int = 4) -> List[str]:
+    """
+    Given a list of article titles, returns a list of short descriptions, in the same order.  Titles are matched back
+    to pages by following the API's normalization and redirects, so this is a bulk replacement for get_desc1.
+    (Makes ceil(n/50) queries to Wikipedia, where n is the number of distinct titles, up to workers at a time.)
+
     :param articles: The list of titles of any article in the specified project. Any spaces should be replaced with underscores. It also should be URI-encoded, so that non-URI-safe characters like %, / or ? are accepted. Example: Are_You_the_One%3F.
     :param timeout: How many seconds to wait for the server to send data before giving up.
-    :return: The list of short descriptions
+    :param workers: How many batches to request at once.
+    :return: The list of short descriptions ("" for None or empty titles)
     """
 
-    descs: List[str] = [""] * len(articles)
+    titles: List[Optional[str]] = [unquote(a).replace("_", " ") if a else None for a in articles]
+    distinct = list(dict.fromkeys(t for t in titles if t is not None))
+    batches = [distinct[i:i+50] for i in range(0, len(distinct), 50)]
 
-    for i in range(0, len(articles), 50):
-        l = min(50, len(articles)-i)
-        url = "https://en.wikipedia.org/w/api.php?format=json&action=query&prop=description&titles="
-        url += '|'.join([a for a in articles[i:i+l] if a is not None])
-        try:
-            resp = requests.get(url, headers=headers, timeout=timeout)
-        except requests.HTTPError:
-            raise
-        contents: json = resp.json()
-        normed: List[str] = deepcopy(articles[i:i+l])
+    descs: Dict[str, str] = {}
+    if len(batches) == 1:
+        descs.update(_get_desc_batch(batches[0], timeout))
+    elif batches:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch_descs in executor.map(lambda batch: _get_desc_batch(batch, timeout), batches):
+                descs.update(batch_descs)
+    return [descs[t] if t is not None else "" for t in titles]
+
+def _get_sitelinks_batch(titles: List[str], timeout: float = 5) -> Dict[str, Union[int, str]]:
+    """
+    Returns the Wikidata sitelink counts of up to 50 titles, keyed by the titles as given.  Makes two requests: one for
+    the titles' Wikidata IDs (from their page props), and one wbgetentities call for the items' sitelinks.
+    """
 
-        for j in range(len(normed)):
-            normed[j] = unquote(normed[j])
+    qids = {title: page.get("pageprops", {}).get("wikibase_item")
+        for title, page in _query_pages(titles, {"prop": "pageprops", "ppprop": "wikibase_item"}, timeout).items()}
+    distinct = list(dict.fromkeys(qid for qid in qids.values() if qid))
 
-        try:
-            if verbose >= 1:
-                print(contents["query"]["normalized"])
-                print(normed)
-            for j in range(len(normed)):
-                for norm in contents["query"]["normalized"]:
-                    if normed[j] == norm["from"]:
-                        normed[j] = norm["to"]
-        except KeyError:
-            if verbose >= 1:
-                print("Encountered KeyError")
-            pass
-
-        for j in range(l):
-            for page in contents["query"]["pages"]:
-                if normed[j] == contents["query"]["pages"][page]["title"]:
-                    try:
-                        descs[i+j] = contents["query"]["pages"][page]["description"]
-                    except:
-                        descs[i+j] = "ERROR: No short description found."
-    if verbose >= 1:
-        for i in range(len(articles)):
-            print("   > Got description: {} | {} | {}".format(articles[i], normed[i], descs[i]))
-    return descs
+    entities: Dict[str, Any] = {}
+    if distinct:
+        params = {"format": "json", "action": "wbgetentities", "props": "sitelinks", "ids": "|".join(distinct)}
+        entities = get_json("https://www.wikidata.org/w/api.php", params, timeout=timeout).get("entities", {})
+
+    counts: Dict[str, Union[int, str]] = {}
+    for title in titles:
+        qid = qids[title]
+        if not qid or qid not in entities or "missing" in entities[qid]:
+            counts[title] = "ERROR: No Wikidata item found."
+        else:
+            counts[title] = len(entities[qid].get("sitelinks", {}))
+        if verbose >= 1:
+            print("   > Got sitelinks: {} | {} | {}".format(title, qid, counts[title]))
+    return counts
+
+
+def _get_sitelinks_keyed(keys: List[Tuple[str, float]]) -> Dict[Tuple[str, float], Union[int, str]]:
+    """
+    Like _get_sitelinks_batch, for sitelinks_batcher's (title, timeout) keys.  The batch waits as long as its most
+    patient caller asked to.
+    """
+
+    counts = _get_sitelinks_batch(list(dict.fromkeys(title for title, _ in keys)), max(timeout for _, timeout in keys))
+    return {key: counts[key[0]] for key in keys}
+
+
+def get_sitelinks(articles: List[Optional[str]] = [], timeout: float = 5, workers: int = 4) -> List[Union[int, str]]:
+    """
+    Given a list of article titles, returns how many Wikimedia sites (Wikipedias in other languages, Wikiquote, ...)
+    link to each article's Wikidata item, in the same order.  It is a cheap fame metric: 50 articles cost two requests,
+    where pageviews cost one request per article, so it suits ranking many notes before fetching their pageviews.
+    (Makes 2 * ceil(n/50) queries, where n is the number of distinct titles, up to workers batches at a time.)
+
+    :param articles: The list of titles of any article in en.wikipedia.org, as URL strings (see get_desc).
+    :param timeout: How many seconds to wait for the server to send data before giving up.
+    :param workers: How many batches to request at once.
+    :return: The list of sitelink counts ("" for None or empty titles)
+    """
+
+    titles: List[Optional[str]] = [unquote(a).replace("_", " ") if a else None for a in articles]
+    distinct = list(dict.fromkeys(t for t in titles if t is not None))
+    batches = [distinct[i:i+50] for i in range(0, len(distinct), 50)]
+
+    counts: Dict[str, Union[int, str]] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_counts in executor.map(lambda batch: _get_sitelinks_batch(batch, timeout), batches):
+            counts.update(batch_counts)
+    return [counts[t] if t is not None else "" for t in titles]
+
+
+def _read_inputs(lines: Iterable[str], titles: bool) -> Iterator[Dict[str, Any]]:
+    """
+    Parses CLI input lines, each either a JSON object or a bare phrase (or title).  Blank lines are skipped.
+    """
+
+    for no, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                item = json.loads(line)
+            except ValueError as err:
+                item = {"error": "Invalid JSON: {}".format(err)}
+        else:
+            item = {"title" if titles else "phrase": line}
+        item.setdefault("line", no)
+        yield item
+
+
+def _fame_of(
+    item: Dict[str, Any],
+    project: str,
+    start: str,
+    end: str,
+    desc: bool,
+    timeout: float,
+    sitelinks: bool = False,
+    ) -> Dict[str, Any]:
+    """
+    Looks up the article, pageviews and (optionally) description and sitelink count for one CLI input.
+    """
+
+    result = dict(item)
+    if "error" in item:
+        return result
+    try:
+        if item.get("title"):
+            article = title_to_article(unquote(item["title"]))
+        else:
+            article = shared_search_article_url(item["phrase"], timeout)
+        result["article"] = article
+        if article is not None:
+            result["pageviews"] = shared_get_pageviews(article, project, timeout, start=start, end=end)
+            if desc:
+                result["desc"] = shared_get_desc1(article, timeout)
+            if sitelinks:
+                result["sitelinks"] = shared_get_sitelinks(article, timeout)
+    except Exception as err:
+        result["error"] = "{}: {}".format(type(err).__name__, err)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Streams phrases (or titles) from stdin or a file through the concurrent, cached fetch path, writing one JSONL
+    result per input as each completes.  Only about 2 * concurrency inputs are held at once, so memory stays bounded.
+
+        cut -f1 names.tsv | python -m orderanki.wiki -c 50 -r 100 --cache fame.sqlite > fame.jsonl
+    """
+
+    global verbose, cache, cache_max_age, limiter, hedger, tape, search_flight, article_flight
+
+    parser = ArgumentParser(prog="python -m orderanki.wiki", description=
+    """Reads one search phrase per line (or JSON objects with a "phrase" or "title" key; other keys are passed
+    through), and writes one JSON object per input with its "article", "pageviews" and, with --desc, "desc" (and with
+    --sitelinks, "sitelinks").
+    Results are written as they complete, so they may come out of order; each carries its input "line".""")
+    parser.add_argument("input", nargs="?", default="-", help="input file, or - for stdin (the default)")
+    parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout (the default)")
+    parser.add_argument("-t", "--titles", action="store_true", help="bare input lines are article titles, not search phrases")
+    parser.add_argument("-d", "--desc", action="store_true", help="also get each article's short description")
+    parser.add_argument("--sitelinks", action="store_true", help="also get each article's Wikidata sitelink count")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="how many requests may be in flight at once")
+    parser.add_argument("-r", "--rate", type=int, default=100, help="the most requests to send per second")
+    parser.add_argument("--cache", default=None, help="an SQLite file to cache responses in, shared between runs")
+    parser.add_argument("--max-age", type=float, default=None, metavar="DAYS",
+                        help="revalidate cached responses older than this, with conditional requests where possible")
+    parser.add_argument("--timeout", type=float, default=5, help="seconds to wait for each response")
+    parser.add_argument("--hedge", type=float, default=0, metavar="BUDGET",
+                        help="re-send requests slower than the p95, up to this fraction of all requests (e.g. 0.05)")
+    parser.add_argument("--project", default="en.wikipedia.org", help="the Wikimedia project for pageviews")
+    parser.add_argument("-s", "--start", default="20150701", help="the first day of pageview data, YYYYMMDD")
+    parser.add_argument("-e", "--end", default="20230101", help="the last day of pageview data, YYYYMMDD")
+    parser.add_argument("--record", metavar="CASSETTE", default=None, help="record every response to a cassette file")
+    parser.add_argument("--replay", metavar="CASSETTE", default=None, help="replay responses from a cassette file, with no network")
+    parser.add_argument("--pace", action="store_true", help="when replaying, take as long as the recorded responses did")
+    parser.add_argument("-v", "--verbose", type=int, default=0, help="verbosity of progress messages, written to stderr")
+    args = parser.parse_args(argv)
+
+    verbose = args.verbose
+    limiter = net.RateLimiter(args.rate, 1)
+    if args.cache:
+        cache = net.Cache(args.cache)
+        cache_max_age = args.max_age * 86400 if args.max_age is not None else None
+    if args.hedge > 0:
+        hedger = net.Hedger(budget=args.hedge)
+    if args.record or args.replay:
+        tape = cassette.Cassette(args.record or args.replay, "record" if args.record else "replay", pace=args.pace)
+    # Only share calls in flight; the cache (if any) takes care of repeats, and memory stays bounded
+    search_flight = SingleFlight(keep=False)
+    article_flight = SingleFlight(keep=False)
+
+    fin = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    inputs = _read_inputs(fin, args.titles)
+    window = 2 * args.concurrency
+    with contextlib.redirect_stdout(sys.stderr), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        pending = set()
+        while True:
+            for item in itertools.islice(inputs, window - len(pending)):
+                pending.add(executor.submit(_fame_of, item, args.project, args.start, args.end, args.desc, args.timeout,
+                    args.sitelinks))
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                fout.write(json.dumps(future.result(), ensure_ascii=False) + "\n")
+            fout.flush()
+
+    if fin is not sys.stdin:
+        fin.close()
+    if fout is not sys.stdout:
+        fout.close()
+    if cache is not None:
+        cache.close()
+    if tape is not None:
+        tape.close()
+    if hedger is not None:
+        hedger.close()
+        if verbose >= 1:
+            print("Hedged {} of {} requests ({} hedges won)".format(hedger.hedges, hedger.calls, hedger.hedge_wins), file=sys.stderr)
 
 if __name__ == "__main__":
-    get_pageviews("Noodle")
-    get_pageviews("")
-    get_pageviews("Donald_Trump")
-    search_article_url("Noodles")
-    get_pageviews(search_article_url("Stoke on Trent"))
-    get_desc1("Apple")
-    get_desc(["A","B","ILEUFLIDWUF","D","are_You_the_One%3F","Joe_Biden","WLIEHUFDWLIUHF"])
\ No newline at end of file
+    main()